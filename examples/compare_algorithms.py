@@ -1,4 +1,3 @@
-import numpy as np
 import pandas as pd
 from itertools import product
 import pystallment.option as opt
@@ -30,13 +29,8 @@ if __name__ == "__main__":
         fdm_pricer = fdm.FDMPricer(option)
         fdm_price = fdm_pricer.price()
 
-        lsmc_prices = []
-        for i in range(100):
-            lsmc_pricer = lsmc.LSMCPricer(option)
-            lsmc_pricer.num_paths = 100000
-            lsmc_prices.append( lsmc_pricer.price() )
-
-        lsmc_price = np.mean(lsmc_prices)
+        lsmc_pricer = lsmc.LSMCPricer(option)
+        lsmc_price = lsmc_pricer.price_to_tolerance(atol=5e-3, batch_paths=100000, max_paths=10000000)
 
         bin_pricer = bin.BinomialPricer(option)
         bin_price = bin_pricer.price()
@@ -52,6 +46,7 @@ if __name__ == "__main__":
             "FDM": round(fdm_price, 4),
             "Binomial": round(bin_price, 4),
             "LSMC": round(lsmc_price, 4),
+            "LSMC Std Error": lsmc_pricer.std_error,
             "FDM-Binomial Diff": (fdm_price - bin_price),
             "FDM-LSMC Diff": (fdm_price-lsmc_price),
             "Binomial-LSMC Diff": (bin_price - lsmc_price),
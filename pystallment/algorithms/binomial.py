@@ -1,18 +1,82 @@
+import copy
 import numbers
 import numpy as np
 
+from pystallment import black_scholes as bs
 from pystallment.option import AmericanOption
+from pystallment.algorithms.boundary import find_edge, find_edges
+
+def _peizer_pratt(z, n):
+    """
+    Peizer-Pratt method 2 inversion of the normal distribution for a tree with n steps
+    """
+    return 0.5 + np.sign(z) * 0.5 * np.sqrt(1 - np.exp(-(z / (n + 1 / 3 + 0.1 / (n + 1))) ** 2 * (n + 1 / 6)))
+
+def _up_down_p(r, d, vola, dt, factor_adjustment, S=None, K=None, num_steps=None):
+    """
+    Compute the up and down factors and the up probability of a binomial step.
+    All market parameters may be scalars or arrays of equal length.
+    The Leisen-Reimer tree ('lr') additionally needs spot, strike and the number of steps.
+    """
+    up = np.exp(vola * np.sqrt(dt))
+    do = 1 / up
+
+    if factor_adjustment == 'r-d':
+        alfa = np.exp((r - d) * dt)
+        up *= alfa
+        do *= alfa
+        p = (alfa - do) / (up - do)
+    elif factor_adjustment == '-d':
+        alfa = np.exp(- d * dt)
+        up *= alfa
+        do *= alfa
+        p = (alfa * np.exp(r * dt) - do) / (up - do)
+    elif factor_adjustment == 'lr':
+        T = dt * num_steps
+        d1 = bs.d1(S, K, r, d, vola, T)
+        d2 = bs.d2_from_d1(d1, vola, T)
+        alfa = np.exp((r - d) * dt)
+        p = _peizer_pratt(d2, num_steps)
+        up = alfa * _peizer_pratt(d1, num_steps) / p
+        do = (alfa - p * up) / (1 - p)
+    else:
+        raise TypeError(f"factor adjustment {factor_adjustment} not supported.")
+
+    return (up, do, p)
+
+def _richardson(num_steps, coarse, fine_steps, fine):
+    """
+    Richardson extrapolation of two tree values, assuming an error proportional to 1/num_steps
+    """
+    return (fine_steps*fine - num_steps*coarse) / (fine_steps - num_steps)
 
 class BinomialPricer:
-    def __init__(self, option, num_steps = 1000, factor_adjustment='r-d'):
+    def __init__(self, option, num_steps = 1000, factor_adjustment='r-d', lattice='compact', track_bounds=True,
+                 smoothing=False, richardson=False, truncation=None):
         """
         Construct a BinomialPricer for American option and installment options
         :param option: option of type AmericanOption or ContinuousInstallmentOption
         :param num_steps: depth of the binomial tree
-        :param factor_adjustment: the up and down steps in the tree are adjusted ('r-d' or '-d')
+        :param factor_adjustment: the up and down steps in the tree are adjusted ('r-d' or '-d'),
+            or chosen by the Leisen-Reimer inversion ('lr', best with an odd number of steps)
+        :param lattice: 'compact' generates the spots of each level on the fly with O(num_steps) memory,
+            'full' stores the whole (num_steps+1)x(num_steps+1) price matrix
+        :param track_bounds: record the stop and exercise boundaries, switch off if only the price is needed
+        :param smoothing: replace the last step of the tree by the Black-Scholes value (BBS)
+        :param richardson: extrapolate the prices of trees with num_steps and 2*num_steps steps
+            (2*num_steps+1 for 'lr'), the boundaries are those of the finer tree
+        :param truncation: only evaluate the nodes within this many standard deviations of the forward,
+            the nodes beyond take their payoff (e.g. 6), None evaluates the whole tree
         """
         self.num_steps = num_steps
         self.factor_adjustment = factor_adjustment
+        self.lattice = lattice
+        self.track_bounds = track_bounds
+        self.smoothing = smoothing
+        self.richardson = richardson
+        self.truncation = truncation
+        self.converged_steps = None
+        self.error_estimate = None
         self._option = option
         self._is_american = isinstance(option, AmericanOption)
 
@@ -21,25 +85,12 @@ class BinomialPricer:
         self.ex_bound = np.zeros(self.num_steps + 1)
         self.stop_bound[-1] = self._option.K
         self.ex_bound[-1] = self._option.K
+        self._stop_index = None
+        self._ex_index = None
 
     def _get_up_down_p(self, dt):
-        up = np.exp(self._option.vola * np.sqrt(dt))
-        do = 1 / up
-
-        if self.factor_adjustment == 'r-d':
-            alfa = np.exp((self._option.r - self._option.d) * dt)
-            up *= alfa
-            do *= alfa
-            p = (alfa - do) / (up - do)
-        elif self.factor_adjustment == '-d':
-            alfa = np.exp(- self._option.d * dt)
-            up *= alfa
-            do *= alfa
-            p = (alfa * np.exp(self._option.r * dt) - do) / (up - do)
-        else:
-            pass
-
-        return (up, do, p)
+        return _up_down_p(self._option.r, self._option.d, self._option.vola, dt, self.factor_adjustment,
+                          self._option.S, self._option.K, self.num_steps)
 
     def _generate_all_prices(self, up, do):
         prices = np.zeros((self.num_steps+1, self.num_steps+1))
@@ -52,22 +103,75 @@ class BinomialPricer:
 
         return prices
 
-    def _check_stop_event(self, step, V, S):
-        if self._is_american:
-            exercise_value = self._option.payoff(S)
-            exercise = V <= exercise_value
-            V = np.where(exercise, exercise_value, V)
-            idx = -1 if self._option.phi == -1 else 0
-            ex_index = np.where(exercise)[0][idx] if np.any(exercise) else None
-            self.ex_bound[step] = S[ex_index] if ex_index is not None else self.ex_bound[step + 1]
+    def _generate_level_factors(self, up, do):
+        """
+        Generate the two geometric vectors from which every level of the tree is built:
+        the spot S*up^step of the top node at each step and the ratios (do/up)^j down the level.
+        """
+        self._top = self._option.S * up ** np.arange(self.num_steps + 1)
+        self._alphas = np.ones(self.num_steps + 1)
+        self._alphas[1:] = np.cumprod(np.ones(self.num_steps) * do / up)
 
-        stop = V < 0
-        V = np.where(stop, 0, V)
-        idx = -1 if self._option.phi == +1 else 0
-        stop_index = np.where(stop)[0][idx] if np.any(stop) else None
-        self.stop_bound[step] = S[stop_index] if stop_index is not None else self.stop_bound[step + 1]
+    def _level_prices(self, step, lo=0, hi=None):
+        # spots of the nodes lo to hi (default: all) of a level
+        hi = step if hi is None else hi
+        if self.lattice == 'full':
+            return self._prices[step, lo:(hi+1)]
+        return self._top[step] * self._alphas[lo:(hi+1)]
+
+    def _node_bands(self, T):
+        """
+        First and last node of every level within truncation standard deviations of the forward,
+        computed once for all steps of the tree
+        """
+        steps = np.arange(self.num_steps + 1)
+        if self.truncation is None:
+            self._lo, self._hi = [0] * len(steps), steps.tolist()
+            return
+        # log distance of node j from the forward is offset - j*spacing
+        offset = steps * (np.log(self._up) - (self._option.r - self._option.d) * self._dt)
+        spacing = np.log(self._up / self._do)
+        width = self.truncation * self._option.vola * np.sqrt(T)
+        lo = np.maximum(np.ceil((offset - width) / spacing), 0).astype(int)
+        hi = np.minimum(np.floor((offset + width) / spacing), steps).astype(int)
+        self._lo, self._hi = lo.tolist(), np.maximum(lo, hi).tolist()
+
+    def _extend(self, step, values, cur_lo, cur_hi, lo, hi):
+        """
+        Extend the values of a level, known for the nodes cur_lo to cur_hi, to the nodes lo to hi.
+        The values are kept in place in a buffer indexed by node, the nodes beyond the truncation band
+        take their payoff.
+        """
+        if lo < cur_lo:
+            values[lo:cur_lo] = self._option.payoff(self._level_prices(step, lo, cur_lo-1))
+        if hi > cur_hi:
+            values[(cur_hi+1):(hi+1)] = self._option.payoff(self._level_prices(step, cur_hi+1, hi))
+
+    def _check_stop_event(self, step, V, S, lo=0):
+        # the nodes of a level are ordered by descending spot, V and S start at node lo
+        exercise_value = self._option.payoff(S) if self._is_american else None
+        if self.track_bounds:
+            # the events are searched near the edges of the step before, on the values before the projection
+            if self._is_american:
+                # out of the money nodes with zero or negative value are stop events, not exercise events
+                self._ex_index = self._find_node(V, exercise_value, self._ex_index, lo, self._option.phi == +1,
+                                                 strict=False, intrinsic=exercise_value, in_the_money=True)
+                self.ex_bound[step] = S[self._ex_index - lo] if self._ex_index is not None else self.ex_bound[step + 1]
+            self._stop_index = self._find_node(V, 0.0, self._stop_index, lo, self._option.phi == -1,
+                                               intrinsic=exercise_value, in_the_money=False)
+            self.stop_bound[step] = S[self._stop_index - lo] if self._stop_index is not None else self.stop_bound[step + 1]
+
+        if self._is_american:
+            np.maximum(V, exercise_value, out=V)
+        np.maximum(V, 0, out=V)
         return V
 
+    @staticmethod
+    def _find_node(V, obstacle, node, lo, lower, **conditions):
+        # edge search in the window of nodes starting at lo
+        index = find_edge(V, obstacle, None if node is None else node - lo, lower, **conditions)
+        return None if index is None else index + lo
+
     def _get_ttm(self):
         if hasattr(self._option, "T"):
             if isinstance(self._option.T, numbers.Number):
@@ -99,21 +203,275 @@ class BinomialPricer:
         # get optional installment rate
         qi = self._get_installment_rate()/self._option.r*(1-df)
 
-        V = self._option.payoff(self._prices[self.num_steps, :])
-        for step in range(self.num_steps-1, -1, -1):
-            V_ = df*(self._p*V[:(step+1)] + (1-self._p)*V[1:]) - qi
-            V_ = self._check_stop_event(step, V_, self._prices[step, :(step+1)])
-            V = V_
+        # the values of the current level indexed by node, and scratch space for the induction
+        values = np.empty(self.num_steps + 2)
+        down = np.empty(self.num_steps + 1)
+        if self.smoothing:
+            # the last step is replaced by the European value over one time step
+            last_step = self.num_steps - 1
+            lo, hi = self._lo[last_step], self._hi[last_step]
+            S = self._level_prices(last_step, lo, hi)
+            V = bs.option_value(S, self._option.K, self._option.r, self._option.d, self._option.vola, self._dt,
+                                self._option.phi) - qi
+            V = self._check_stop_event(last_step, V, S, lo)
+            self._keep_level(last_step, V, S)
+        else:
+            last_step = self.num_steps
+            lo, hi = self._lo[last_step], self._hi[last_step]
+            V = self._option.payoff(self._level_prices(last_step, lo, hi))
+        values[lo:(hi+1)] = V
+
+        for step in range(last_step-1, -1, -1):
+            next_lo, next_hi = lo, hi
+            lo, hi = self._lo[step], self._hi[step]
+            self._extend(step+1, values, next_lo, next_hi, lo, hi+1)
+            S = self._level_prices(step, lo, hi)
+            # V = df*(p*V_up + (1-p)*V_down) - qi, computed in place
+            V = values[lo:(hi+1)]
+            V_down = np.multiply(values[(lo+1):(hi+2)], 1-self._p, out=down[:(hi-lo+1)])
+            np.multiply(V, self._p, out=V)
+            V += V_down
+            V *= df
+            V -= qi
+            self._check_stop_event(step, V, S, lo)
+            if lo == 0 and hi == step:
+                self._keep_level(step, V.copy(), S)
+
+        return values[0]
+
+    def _keep_level(self, step, V, S):
+        # the first levels of the tree carry delta, gamma and theta
+        if step <= 2:
+            self._levels[step] = (S, V)
+
+    def _tree_greeks(self):
+        """
+        Compute delta, gamma and theta from the levels 0 to 2 of the last tree
+        """
+        (S0, V0), (S1, V1), (S2, V2) = (self._levels[step] for step in range(3))
+        delta = (V1[0] - V1[1]) / (S1[0] - S1[1])
+        delta_up = (V2[0] - V2[1]) / (S2[0] - S2[1])
+        delta_down = (V2[1] - V2[2]) / (S2[1] - S2[2])
+        gamma = (delta_up - delta_down) / (0.5 * (S2[0] - S2[2]))
+        # the middle node of level 2 is not at the spot in drift adjusted trees
+        dS = S2[1] - S0[0]
+        theta = (V2[1] - V0[0] - delta * dS - 0.5 * gamma * dS**2) / (2 * self._dt)
+        return np.array([delta, gamma, theta])
+
+    def _sensitivities_steps(self, num_steps):
+        """
+        Price the option with a tree of the given depth, together with delta, gamma and theta
+        """
+        value = self._price_steps(num_steps)
+        return np.concatenate(([value], self._tree_greeks()))
+
+    def _price_steps(self, num_steps):
+        """
+        Price the option with a tree of the given depth
+        """
+        default_steps = self.num_steps
+        self.num_steps = num_steps
+        try:
+            return self._price()
+        finally:
+            self.num_steps = default_steps
+
+    def _fine_steps(self, num_steps):
+        # Leisen-Reimer trees need an odd number of steps
+        return 2*num_steps + 1 if self.factor_adjustment == 'lr' else 2*num_steps
+
+    def _extrapolate(self, num_steps, coarse, run=None):
+        """
+        Richardson extrapolation of the price of a tree with num_steps and a tree with about twice the depth,
+        assuming an error proportional to 1/num_steps
+        :param run: the function computing the value of the finer tree, defaults to its price
+        """
+        run = run or self._price_steps
+        fine_steps = self._fine_steps(num_steps)
+        return _richardson(num_steps, coarse, fine_steps, run(fine_steps))
+
+    def price_to_tolerance(self, atol=1e-4, rtol=0.0, start_steps=50, max_steps=16000):
+        """
+        Price the option with trees whose depth grows geometrically until two successive estimates agree within
+        max(atol, rtol*|price|). With richardson=True the estimates are the extrapolated prices, and every tree
+        enters two successive extrapolations. The depth of the last tree is stored in converged_steps, the
+        difference of the last two estimates in error_estimate.
+        :param atol: absolute tolerance
+        :param rtol: relative tolerance
+        :param start_steps: depth of the first tree
+        :param max_steps: the depth is not grown beyond this limit, even if the tolerance is not met
+        :return: the price
+        """
+        num_steps = start_steps
+        coarse = self._price_steps(num_steps)
+        estimate = coarse
+        previous = None if self.richardson else coarse
+        self.converged_steps = num_steps
+        self.error_estimate = np.inf
+        while True:
+            fine_steps = self._fine_steps(num_steps)
+            if fine_steps > max_steps:
+                # the next tree would be deeper than the limit, the last estimate is returned
+                break
+            fine = self._price_steps(fine_steps)
+            estimate = _richardson(num_steps, coarse, fine_steps, fine) if self.richardson else fine
+            self.converged_steps = fine_steps
+            if previous is not None:
+                self.error_estimate = abs(estimate - previous)
+                if self.error_estimate <= max(atol, rtol * abs(estimate)):
+                    break
+            previous, num_steps, coarse = estimate, fine_steps, fine
 
-        return V[0]
+        return estimate
 
     def price(self):
+        if self.richardson:
+            return self._extrapolate(self.num_steps, self._price_steps(self.num_steps))
+
+        return self._price()
+
+    def _bumped_price(self, **bumps):
+        """
+        Price the option with shifted parameters without recording any boundary
+        """
+        option = copy.copy(self._option)
+        for name, bump in bumps.items():
+            setattr(option, name, getattr(option, name) + bump)
+        pricer = copy.copy(self)
+        pricer._option = option
+        pricer.track_bounds = False
+        return pricer.price()
+
+    def greeks(self, vola_bump=1e-2, rate_bump=1e-3):
+        """
+        Compute the price and its sensitivities. Delta, gamma and theta are read off the first levels of the
+        same tree, vega and rho need one additional price-only tree each (forward differences).
+        :param vola_bump: shift of the volatility for vega
+        :param rate_bump: shift of the riskfree rate for rho
+        :return: dict with price, delta, gamma, theta, vega and rho
+        """
+        if self.num_steps < 3:
+            raise ValueError("greeks need a tree with at least 3 steps")
+
+        values = self._sensitivities_steps(self.num_steps)
+        if self.richardson:
+            values = self._extrapolate(self.num_steps, values, self._sensitivities_steps)
+        price, delta, gamma, theta = values
+
+        vega = (self._bumped_price(vola=vola_bump) - price) / vola_bump
+        rho = (self._bumped_price(r=rate_bump) - price) / rate_bump
+        return {"price": price, "delta": delta, "gamma": gamma, "theta": theta, "vega": vega, "rho": rho}
+
+    def _price(self):
         self._init_bounds()
+        self._levels = {}
         # get parameters
         T = self._get_ttm()
         self._dt = T / self.num_steps
         # build price tree
         up, do, self._p = self._get_up_down_p(self._dt)
-        self._prices = self._generate_all_prices(up, do)
+        self._up, self._do = up, do
+        if self.lattice == 'full':
+            self._prices = self._generate_all_prices(up, do)
+        elif self.lattice == 'compact':
+            self._generate_level_factors(up, do)
+        else:
+            raise TypeError(f"lattice {self.lattice} not supported.")
+        self._node_bands(T)
+
+        return self._iterate_tree()
+
+class BinomialBatchPricer:
+    def __init__(self, S, K, r, d, vola, T, q=0, phi=+1, american=False, num_steps=1000, factor_adjustment='r-d',
+                 track_bounds=True):
+        """
+        Construct a BinomialBatchPricer which prices a whole book of options in one backward induction.
+        Every parameter may be a scalar or an array; all are broadcast to a common length.
+        :param S: spot prices
+        :param K: strike prices
+        :param r: riskfree rates
+        :param d: dividend yields
+        :param vola: volatilities
+        :param T: times to maturity
+        :param q: continuous installment rates (0 for vanilla options)
+        :param phi: option types (+1 for call, -1 for put)
+        :param american: flags for early exercise
+        :param num_steps: depth of the binomial tree, shared by all options
+        :param factor_adjustment: the up and down steps in the tree are adjusted ('r-d' or '-d')
+        :param track_bounds: record the stop and exercise boundaries, switch off if only the prices are needed
+        """
+        (self.S, self.K, self.r, self.d, self.vola, self.T, self.q, self.phi) = np.broadcast_arrays(
+            *[np.atleast_1d(np.asarray(x, dtype=float)) for x in (S, K, r, d, vola, T, q, phi)])
+        self.american = np.broadcast_to(np.asarray(american, dtype=bool), self.S.shape)
+        self.num_steps = num_steps
+        self.factor_adjustment = factor_adjustment
+        self.track_bounds = track_bounds
 
-        return self._iterate_tree()
\ No newline at end of file
+    @classmethod
+    def from_options(cls, options, num_steps=1000, factor_adjustment='r-d', track_bounds=True):
+        """
+        Construct a BinomialBatchPricer from a list of option objects
+        :param options: options of type Option, AmericanOption or (American)ContinuousInstallmentOption
+        :param num_steps: depth of the binomial tree
+        :param factor_adjustment: the up and down steps in the tree are adjusted ('r-d' or '-d')
+        :param track_bounds: record the stop and exercise boundaries
+        """
+        def column(f):
+            return [f(o) for o in options]
+
+        return cls(column(lambda o: o.S), column(lambda o: o.K), column(lambda o: o.r), column(lambda o: o.d),
+                   column(lambda o: o.vola), column(lambda o: o.T),
+                   column(lambda o: o.installment_rate if hasattr(o, "installment_rate") else 0),
+                   column(lambda o: o.phi), column(lambda o: isinstance(o, AmericanOption)),
+                   num_steps, factor_adjustment, track_bounds)
+
+    def _init_bounds(self):
+        self.stop_bound = np.zeros((len(self.S), self.num_steps + 1))
+        self.ex_bound = np.zeros((len(self.S), self.num_steps + 1))
+        self.stop_bound[:, -1] = self.K
+        self.ex_bound[:, -1] = self.K
+
+    def _check_stop_event(self, step, V, S):
+        # the nodes of a level are ordered by descending spot
+        stop = V < 0
+        if np.any(self.american):
+            exercise_value = np.maximum(self.phi[:, None] * (S - self.K[:, None]), 0)
+            # out of the money nodes with zero or negative value are no exercise events
+            exercise = self.american[:, None] & (V <= exercise_value) & (exercise_value > 0)
+            V = np.where(exercise, exercise_value, V)
+            stop &= ~exercise
+            if self.track_bounds:
+                ex_bound = find_edges(exercise, S, self.phi == -1, self.ex_bound[:, step + 1])
+                self.ex_bound[:, step] = np.where(self.american, ex_bound, self.ex_bound[:, step])
+
+        if self.track_bounds:
+            self.stop_bound[:, step] = find_edges(stop, S, self.phi == +1, self.stop_bound[:, step + 1])
+        np.maximum(V, 0, out=V)
+        return V
+
+    def _iterate_tree(self, up, do, p):
+        df = np.exp(-self.r * self._dt)[:, None]
+        qi = (self.q / self.r)[:, None] * (1 - df)
+        p = p[:, None]
+        inv_up = (1 / up)[:, None]
+
+        nodes = np.arange(self.num_steps + 1)
+        S = self.S[:, None] * np.exp(self.num_steps * np.log(up)[:, None] + np.log(do / up)[:, None] * nodes)
+        V = np.maximum(self.phi[:, None] * (S - self.K[:, None]), 0)
+        for step in range(self.num_steps - 1, -1, -1):
+            V = df * (p * V[:, :(step+1)] + (1 - p) * V[:, 1:]) - qi
+            S = S[:, :(step+1)] * inv_up
+            V = self._check_stop_event(step, V, S)
+
+        return V[:, 0]
+
+    def price(self):
+        """
+        Price all options of the book
+        :return: array of option prices
+        """
+        self._init_bounds()
+        self._dt = self.T / self.num_steps
+        up, do, p = _up_down_p(self.r, self.d, self.vola, self._dt, self.factor_adjustment, self.S, self.K,
+                               self.num_steps)
+        return self._iterate_tree(up, do, p)
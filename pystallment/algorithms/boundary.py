@@ -0,0 +1,111 @@
+"""
+This module tracks exercise and stop boundaries through the backward induction of the lattice and grid engines.
+Both event regions are contiguous and anchored at one end of the spot axis, and their edge moves monotonically
+from one time step to the next, so the edge is searched near its previous position only.
+"""
+import numpy as np
+
+def find_edge(V, obstacle, guess=None, lower=True, window=8, strict=True, intrinsic=None, in_the_money=True):
+    """
+    Find the edge of a contiguous event region which is anchored at one end of the array. A node is an event if
+    its value lies below the obstacle. The condition is only evaluated on windows which grow outwards from the
+    guess, so the cost is proportional to the distance the edge moved, not to the number of nodes.
+    :param V: the values of the nodes before they are projected onto the obstacle
+    :param obstacle: the obstacle, an array or a scalar
+    :param guess: the edge index of the previous time step, None if there was no event
+    :param lower: True if the region is anchored at index 0 (the edge is the last event node),
+        False if it is anchored at the last index (the edge is the first event node)
+    :param window: number of nodes searched around the guess, the window doubles until the edge is found
+    :param strict: True if an event needs V < obstacle, False if V <= obstacle suffices
+    :param intrinsic: intrinsic values of the nodes which restrict the events, None for no restriction
+    :param in_the_money: True if events need a positive intrinsic value, False if they need a zero or negative one
+    :return: the edge index or None if there is no event
+    """
+    n = len(V)
+    scalar = not isinstance(obstacle, np.ndarray)
+
+    def event(start, end):
+        # the event flags of the nodes start to end-1, counted from the anchor
+        if not lower:
+            start, end = n - end, n - start
+        values = V[start:end]
+        bound = obstacle if scalar else obstacle[start:end]
+        flags = values < bound if strict else values <= bound
+        if intrinsic is not None:
+            flags &= (intrinsic[start:end] > 0) == in_the_money
+        return flags if lower else flags[::-1]
+
+    def is_event(i):
+        # the event flag of node i, counted from the anchor, on python floats
+        if not lower:
+            i = n - 1 - i
+        value = V.item(i)
+        bound = obstacle if scalar else obstacle.item(i)
+        if value > bound or (strict and value == bound):
+            return False
+        return intrinsic is None or (intrinsic.item(i) > 0) == in_the_money
+
+    if not lower and guess is not None:
+        guess = n - 1 - guess
+    edge = _find_lower_edge(event, is_event, n, guess, window)
+    return edge if lower or edge is None else n - 1 - edge
+
+def _find_lower_edge(event, is_event, n, guess, window, steps=2):
+    # edge search of a region anchored at index 0: the edge rarely moves by more than a node or two, so the nodes
+    # next to the guess are checked one by one, then the windows evaluated by event(start, end) double in size
+    if n == 0:
+        return None
+
+    if guess is None:
+        # an empty region can only reappear at its anchor
+        if not is_event(0):
+            return None
+        guess = 0
+
+    guess = min(max(guess, 0), n - 1)
+    size = window
+    if is_event(guess):
+        # the edge lies at or above the guess
+        edge = guess
+        while edge < min(guess + steps, n - 1):
+            if not is_event(edge + 1):
+                return edge
+            edge += 1
+        start = edge + 1
+        while start < n:
+            end = min(start + size, n)
+            no_event = np.flatnonzero(~event(start, end))
+            if len(no_event) > 0:
+                return start + no_event[0] - 1
+            start, size = end, 2 * size
+        return n - 1
+
+    # the edge lies below the guess
+    edge = guess - 1
+    while edge >= max(guess - steps, 0):
+        if is_event(edge):
+            return edge
+        edge -= 1
+    end = edge + 1
+    while end > 0:
+        start = max(end - size, 0)
+        hits = np.flatnonzero(event(start, end))
+        if len(hits) > 0:
+            return start + hits[-1]
+        end, size = start, 2 * size
+    return None
+
+def find_edges(event, S, first, previous):
+    """
+    Find the boundary of every row of a batch of event regions
+    :param event: 2-D boolean array marking the event nodes of each row
+    :param S: 2-D array of the spots of the nodes
+    :param first: flags per row, True if the boundary is the first event node of the row, False if it is the last
+    :param previous: the boundaries of the time step before, kept where a row has no event
+    :return: array of boundaries
+    """
+    first_index = np.argmax(event, axis=1)
+    last_index = event.shape[1] - 1 - np.argmax(event[:, ::-1], axis=1)
+    index = np.where(first, first_index, last_index)
+    bound = np.take_along_axis(S, index[:, None], axis=1)[:, 0]
+    return np.where(np.any(event, axis=1), bound, previous)
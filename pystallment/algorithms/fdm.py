@@ -1,36 +1,221 @@
+import copy
 import numpy as np
 
-from pystallment.option import AmericanOption
-from scipy.linalg import solve_banded
+from pystallment.option import AmericanOption, BermudaOption, DiscreteInstallmentOption
+from pystallment.algorithms.boundary import find_edge, find_edges
+from scipy.linalg.lapack import dgtsv, dgttrf, dgttrs
 
-def _solve_tridiagonal_system(upper, main, lower, b):
+def _factor_tridiagonal(upper, main, lower):
     """
-    Solve a linear system Ax = b, where A is a tridiagonal matrix
+    LU factorization of a tridiagonal matrix A, to be solved repeatedly with _solve_factored
     :param upper: the upper diagonal, preceded by a 0
     :param main: the main diagonal
     :param lower: the lower diagonal, trailed by a 0
-    :param b:
+    :return: the factors
+    """
+    dl, d, du, du2, ipiv, info = dgttrf(lower[:-1], main, upper[1:])
+    if info != 0:
+        raise np.linalg.LinAlgError(f"tridiagonal matrix is singular (info = {info})")
+    return (dl, d, du, du2, ipiv)
+
+def _solve_factored(factors, b):
+    """
+    Solve a linear system Ax = b in place, where A has been factored by _factor_tridiagonal
+    :param factors: the factors of A
+    :param b: the right hand side, a contiguous array which is overwritten by the solution
+    :return: the solution
+    """
+    x, info = dgttrs(*factors, b, overwrite_b=1)
+    if x is not b and not np.shares_memory(x, b):
+        b[:] = x
+    return b
+
+def _solve_penalized(upper, main, lower, b, obstacle, active, penalty=1e8, max_iterations=50):
+    """
+    Solve the linear complementarity problem Ax >= b, x >= obstacle, (Ax - b)(x - obstacle) = 0 in place
+    with the penalty method: the nodes below the obstacle get a large penalty on the diagonal, the system is
+    solved again until the set of these nodes no longer changes.
+    :param upper: the upper diagonal, preceded by a 0
+    :param main: the main diagonal
+    :param lower: the lower diagonal, trailed by a 0
+    :param b: the right hand side, overwritten by the solution
+    :param obstacle: the lower bound of the solution
+    :param active: the initial guess of the nodes below the obstacle
+    :param penalty: the penalty factor
+    :param max_iterations: the maximal number of solves
     :return: the solution
     """
-    ab = np.array([upper, main, lower])
-    x = solve_banded((1, 1), ab, b)
-    return x
+    for _ in range(max_iterations):
+        weight = penalty * active
+        _, _, _, x, info = dgtsv(lower[:-1], main + weight, upper[1:], b + weight * obstacle)
+        if info != 0:
+            raise np.linalg.LinAlgError(f"tridiagonal matrix is singular (info = {info})")
+        below = x < obstacle
+        if np.array_equal(below, active):
+            break
+        active = below
+    b[:] = x
+    return b
+
+def _stretched_grid(S_max, centers, num_steps, width, intensity):
+    """
+    Spot grid on [0, S_max] whose nodes cluster around the given centers. The node density is
+    1 + intensity * sum_c 1/sqrt(1 + ((S-c)/width)^2), its integral is inverted numerically.
+    :param S_max: upper end of the grid
+    :param centers: spots around which the nodes cluster
+    :param num_steps: number of space steps
+    :param width: width of each cluster
+    :param intensity: ratio of the node density at a center to the density far from all centers, minus 1
+    :return: ascending spot grid with num_steps+1 nodes, the centers lie on nodes
+    """
+    S_fine = np.linspace(0, S_max, 8 * num_steps + 1)
+    F = S_fine.copy()
+    for c in centers:
+        F += intensity * width * np.arcsinh((S_fine - c) / width)
+    S = np.interp(np.linspace(F[0], F[-1], num_steps + 1), F, S_fine)
+    # move the nearest inner node onto each center
+    fixed = set()
+    for c in centers:
+        i = int(np.argmin(np.abs(S - c)))
+        if 0 < i < num_steps and i not in fixed:
+            S[i] = c
+            fixed.add(i)
+    return S
+
+def _space_grid(grid, num_steps, K, spots, width, centers):
+    """
+    Build the space grid
+    :param grid: 'uniform', 'stretched' or 'log'
+    :param num_steps: number of space steps
+    :param K: the strike, it lies on a node of the log grid
+    :param spots: the spots the grid has to cover
+    :param width: width of the clusters of the stretched grid
+    :param centers: spots around which the stretched grid clusters
+    :return: the ascending spot nodes and the nodes in the coordinate of the PDE (spot or log spot)
+    """
+    S_max = 3 * max(K, np.max(spots))
+    if grid == 'uniform':
+        S = np.linspace(0, S_max, num_steps + 1)
+        return S, S
+    if grid == 'stretched':
+        S = _stretched_grid(S_max, centers, num_steps, width, 10)
+        return S, S
+    if grid == 'log':
+        # the strike lies on a node
+        x_min = np.log(min(K, np.min(spots)) / 3)
+        x_K = np.log(K)
+        dx = (np.log(S_max) - x_min) / num_steps
+        x = x_K + (np.arange(num_steps + 1) - np.ceil((x_K - x_min) / dx)) * dx
+        return np.exp(x), x
+    raise TypeError(f"Grid {grid} not supported")
+
+def _pde_coefficients(grid, S, vola, mu):
+    """
+    Diffusion and convection coefficients of the PDE at the inner nodes of the grid
+    :param grid: 'uniform', 'stretched' or 'log'
+    :param S: the spot nodes
+    :param vola: volatility, a scalar or a column of a batch
+    :param mu: drift r-d, a scalar or a column of a batch
+    :return: diffusion and convection coefficients
+    """
+    S = S[1:-1]
+    if grid == 'log':
+        ones = np.ones_like(S)
+        return 0.5 * vola**2 * ones, (mu - 0.5 * vola**2) * ones
+    return 0.5 * vola**2 * S**2, mu * S
+
+def _get_operator(y, diffusion, convection, r):
+    """
+    Central differences of the spatial operator of the PDE on an arbitrary ascending grid
+    :param y: the nodes in the coordinate of the PDE
+    :param diffusion: the coefficient of the second derivative at the inner nodes
+    :param convection: the coefficient of the first derivative at the inner nodes
+    :param r: riskfree rate, a scalar or a column of a batch
+    :return: the weights of the left, middle and right neighbour for each inner node
+    """
+    h_lo = y[1:-1] - y[:-2]
+    h_up = y[2:] - y[1:-1]
+    left = (2 * diffusion - convection * h_up) / (h_lo * (h_lo + h_up))
+    right = (2 * diffusion + convection * h_lo) / (h_up * (h_lo + h_up))
+    middle = -(2 * diffusion - convection * (h_up - h_lo)) / (h_lo * h_up) - r
+    return (left, middle, right)
+
+def _get_matrix(operator, scale):
+    """
+    The matrix I - scale*L of the implicit part of a time step
+    :param operator: the weights of the spatial operator L
+    :param scale: theta*dt, the weight of the implicit part times the time step
+    :return: the lower diagonal (trailed by a 0), the main diagonal and the upper diagonal (preceded by a 0),
+        for a batch one block per row
+    """
+    (left, middle, right) = operator
+    a = np.zeros(middle.shape)
+    c = np.zeros(middle.shape)
+    a[..., :-1] = -scale * left[..., 1:]
+    b = 1 - scale * middle
+    c[..., 1:] = -scale * right[..., :-1]
+    return (a, b, c)
+
+def _boundary_values(tau, S, K, r, d, q, phi, american, payments=0.0):
+    """
+    Values at the ends of the grid, deep in or out of the money, with time to maturity tau.
+    All parameters may be columns of a batch, payments is the present value of the remaining discrete installments.
+    """
+    df = np.exp(-r * tau)
+    forward = phi * (S * np.exp(-d * tau) - K * df) - q / r * (1 - df) - payments
+    forward = np.where(american, np.maximum(forward, phi * (S - K)), forward)
+    return np.maximum(forward, 0)
+
+def _get_theta(scheme, steps_from_maturity, rannacher_steps):
+    """
+    Weight of the implicit part of a time step
+    """
+    if scheme == 'implicit':
+        return 1.0
+    if scheme == 'crank-nicolson':
+        # Rannacher start-up: damp the kink of the payoff with implicit steps
+        return 1.0 if steps_from_maturity < rannacher_steps else 0.5
+    raise TypeError(f"Scheme {scheme} not supported")
 
 class FDMPricer:
     """
     Class FDMPricer calculates the price of a European/American vanilla/installment option.
-    At the moment, only the implicit method is implemented.
-    todo: Implement general Runge-Kutta
+    Bermuda options and discrete installment options are priced with jump conditions at their dates:
+    the time grid stops at every date, where the option is exercised or the installment is paid or the option
+    is stopped.
+    The time stepping is chosen by the attribute scheme:
+    'implicit' is first order in time,
+    'crank-nicolson' is second order, its first rannacher_steps steps at maturity are implicit.
+    The early exercise and stop decisions are chosen by the attribute lcp:
+    'projection' takes the maximum with the exercise value and 0 after each time step, which limits the
+    convergence to first order in time,
+    'penalty' solves the linear complementarity problem of each time step with the penalty method.
+    The time grid is chosen by the attribute time_stepping:
+    'uniform' takes time_steps equal steps,
+    'adaptive' starts with a step of T/time_steps/16 at maturity and doubles or refines the step such that
+    the values change by about dnorm (relative) per step.
+    The space grid is chosen by the attribute grid:
+    'uniform' spaces the nodes evenly in spot,
+    'stretched' clusters them around the strike, the spot and the cluster_points (e.g. an expected stop boundary),
+    'log' spaces them evenly in log spot, where the PDE has constant coefficients.
     """
     def __init__(self, option):
         self._option = option
         self.space_steps = 10000
         self.time_steps = int(1600*self._option.T)
+        self.grid = 'uniform'
+        self.scheme = 'implicit'
+        self.rannacher_steps = 2
+        self.lcp = 'projection'
+        self.time_stepping = 'uniform'
+        self.dnorm = 0.1
+        self.cluster_points = []
         self._is_american = isinstance(self._option, AmericanOption)
+        self._has_schedule = isinstance(self._option, (BermudaOption, DiscreteInstallmentOption))
         self._stop = None
         self._ex = None
-        self._delta_S = 0.0
         self._delta_t = 0.0
+        self.track_bounds = True
 
     @property
     def stop(self):
@@ -40,73 +225,411 @@ class FDMPricer:
     def ex(self):
         return self._ex
         
+    @property
+    def times(self):
+        """
+        Returns the time grid on which the boundaries are recorded, non-uniform for adaptive time stepping.
+
+        :return: Times from valuation to maturity.
+        """
+        return self._times
+
     def _init_bounds(self):
-        self._stop = np.zeros(self.time_steps + 1)
-        self._ex = np.zeros(self.time_steps + 1)
-        self._stop[self.time_steps] = self._option.K
-        self._ex[self.time_steps] = self._option.K
-        
-    def _get_matrix(self, S):
-        a = np.zeros(self.space_steps - 1)
-        b = np.zeros(self.space_steps - 1)
-        c = np.zeros(self.space_steps - 1)
-        alpha = -0.5*self._option.vola**2/self._delta_S**2
-        beta = (self._option.r-self._option.d)/(2*self._delta_S)
-        n = len(S)-1
-        a[:(len(a)-1)] = (alpha*(S[2:(len(S)-1)]**2) + beta*S[2:(len(S)-1)])*self._delta_t
-        b = 1 + self._option.vola**2/self._delta_S**2 * self._delta_t * (S[1:n]**2) + self._option.r * self._delta_t
-        c[1:] = (alpha*(S[1:(n-1)]**2) -beta*(S[1:(n-1)]))*self._delta_t
-        return (a, b, c)
+        # the boundaries are recorded backwards from maturity, the time grid is only known at the end
+        self._stop_taus = [self._option.final_strike]
+        self._ex_taus = [self._option.final_strike]
+        self._stop_index = None
+        self._ex_index = None
+
+    def _adjust_for_events(self, S, V, exercise_values):
+        # the boundary nodes are fixed, only the inner nodes of the ascending grid can be events
+        stop_bound = ex_bound = 0.0
+        if self.track_bounds:
+            # the events are searched near the edges of the step before, on the values before the projection
+            inner = V[1:-1]
+            intrinsic = exercise_values[1:-1] if self._is_american else None
+            if self._is_american:
+                # out of the money nodes with negative value are stop events, not exercise events
+                self._ex_index = find_edge(inner, intrinsic, self._ex_index, lower=self._option.phi == -1,
+                                           intrinsic=intrinsic, in_the_money=True)
+                ex_bound = S[self._ex_index + 1] if self._ex_index is not None else self._ex_taus[-1]
+            self._stop_index = find_edge(inner, 0.0, self._stop_index, lower=self._option.phi == +1,
+                                         intrinsic=intrinsic, in_the_money=False)
+            stop_bound = S[self._stop_index + 1] if self._stop_index is not None else self._stop_taus[-1]
+        self._stop_taus.append(stop_bound)
+        self._ex_taus.append(ex_bound)
 
-    def _adjust_for_events(self, t, S, V, exercise_values):
-        # adjust for exercise events
         if self._is_american:
-            exercise = V < exercise_values
-            V = np.where(exercise, exercise_values, V)
-            idx = -1 if self._option.phi == -1 else 0
-            ex_index = np.where(exercise)[0][idx] if np.any(exercise) else None
-            self._ex[t] = S[ex_index] if ex_index is not None else self._ex[t + 1]
-
-        # adjust for stop events
-        stop = V < 0
-        V = np.where(stop, 0, V)
-        idx = -1 if self._option.phi == +1 else 0
-        stop_index = np.where(stop)[0][idx] if np.any(stop) else None
-        self._stop[t] = S[stop_index] if stop_index is not None else self._stop[t + 1]
+            np.maximum(V, exercise_values, out=V)
+        np.maximum(V, 0, out=V)
+        return V
+
+    def _schedule(self):
+        """
+        The dates before maturity of a Bermuda or discrete installment option
+        :return: times to maturity of the dates (ascending), the strikes or installments at the dates
+        """
+        if not self._has_schedule:
+            return np.zeros(0), np.zeros(0)
+        t = np.asarray(self._option.t, dtype=float)
+        K = np.broadcast_to(np.asarray(self._option.K, dtype=float), t.shape)
+        before = t[:-1] < self._option.T
+        return (self._option.T - t[:-1][before])[::-1], K[:-1][before][::-1]
+
+    def _time_steps(self, dates):
+        """
+        Generate the time steps backwards from maturity, every date of the schedule is a node of the time grid.
+        Uniform steps are distributed over the intervals between the dates in proportion to their length.
+        The adaptive steps are chosen after each step from the relative change of the values,
+        see _next_time_step, and restart with the smallest step after each date.
+        """
+        T = self._option.T
+        ends = np.append(dates[dates < (1 - 1e-12) * T], T)
+        if self.time_stepping == 'uniform':
+            start = 0.0
+            for end in ends:
+                n = max(int(round(self.time_steps * (end - start) / T)), 1)
+                for _ in range(n):
+                    yield (end - start) / n
+                start = end
+            return
+        if self.time_stepping != 'adaptive':
+            raise TypeError(f"Time stepping {self.time_stepping} not supported")
+
+        # the steps are multiples 2^j of the smallest step, so the factorizations can be reused
+        smallest = T / self.time_steps / 16
+        tau = 0.0
+        for end in ends:
+            j = 0
+            while end - tau > 1e-12 * T:
+                dt = min(smallest * 2**j, end - tau)
+                change = yield dt
+                tau += dt
+                if change is not None:
+                    target = np.floor(np.log2(self.dnorm / max(change, 1e-300) * dt / smallest))
+                    j = int(np.clip(target, 0, j + 1))
+            tau = end
+
+    def _apply_schedule(self, S, V, amount):
+        """
+        Jump condition at a date: exercise a Bermuda option with strike amount, or pay the installment amount
+        or stop a discrete installment option. The boundary of the date replaces the one of the time step.
+        """
+        if isinstance(self._option, BermudaOption):
+            exercise_values = np.maximum(self._option.phi * (S - amount), 0)
+            index = find_edge(V[1:-1], exercise_values[1:-1], None, lower=self._option.phi == -1,
+                              intrinsic=exercise_values[1:-1], in_the_money=True)
+            if self.track_bounds and index is not None:
+                self._ex_taus[-1] = S[index + 1]
+            np.maximum(V, exercise_values, out=V)
+        else:
+            V -= amount
+            index = find_edge(V[1:-1], 0.0, None, lower=self._option.phi == +1)
+            if self.track_bounds and index is not None:
+                self._stop_taus[-1] = S[index + 1]
+            np.maximum(V, 0, out=V)
         return V
 
-    def _calc(self):
-        # Parameter
-        S_max = max(3 * self._option.S, 3 * self._option.K)
+    def _next_time_step(self, V_old, V):
+        # maximal relative change of the values over the last step, small values are measured against 1% of K
+        scale = np.maximum(np.maximum(np.abs(V_old), np.abs(V)), 0.01 * self._option.final_strike)
+        return np.max(np.abs(V - V_old) / scale)
 
-        self._delta_S = S_max / self.space_steps  # step size in space
-        self._delta_t = self._option.T / self.time_steps  # step size in time
-        S = np.linspace(0, S_max, self.space_steps + 1)  # space grid
+    def _calc(self, spots):
+        K = self._option.final_strike
+        dates, amounts = self._schedule()
+        width = 0.5 * K * self._option.vola * np.sqrt(self._option.T)
+        centers = [K, self._option.S] + list(self.cluster_points)
+        S, y = _space_grid(self.grid, self.space_steps, K, np.append(spots, self._option.S), width, centers)
+        diffusion, convection = _pde_coefficients(self.grid, S, self._option.vola, self._option.r - self._option.d)
 
         q = 0
         if hasattr(self._option, "installment_rate"):
             q = self._option.installment_rate
 
         exercise_values = self._option.payoff(S)
-        V = exercise_values
-        (a, b, c) = self._get_matrix(S)
+        V = exercise_values.copy()
+        operator = _get_operator(y, diffusion, convection, self._option.r)
+        (left, _, right) = operator
+        # factors of the implicit part and weights of the explicit part for each theta and time step
+        steps = {}
+        edges = S[[0, -1]]
+        inner = V[1:self.space_steps]
+        if self.lcp == 'penalty':
+            obstacle = np.maximum(exercise_values, 0) if self._is_american else np.zeros(len(S))
+            obstacle = obstacle[1:self.space_steps]
+        elif self.lcp != 'projection':
+            raise TypeError(f"LCP method {self.lcp} not supported")
+        explicit_part = np.empty(len(inner))
+        work = np.empty(len(inner))
+        adaptive = self.time_stepping == 'adaptive'
 
-        for t in range(self.time_steps - 1, -1, -1):
-            V_ = V[1:self.space_steps] - q * self._delta_t
-            V_inner = _solve_tridiagonal_system(c, b, a, V_)
-            V[1:self.space_steps] = V_inner
+        taus = [0.0]
+        time_steps = self._time_steps(dates)
+        change = None
+        # the next date of the schedule and the number of steps since the last date (or maturity)
+        date = 0
+        steps_after_date = 0
+        while True:
+            try:
+                dt = time_steps.send(change)
+            except StopIteration:
+                break
+            tau = taus[-1] + dt
+            if self._option.T - tau <= 1e-12 * self._option.T:
+                # keep the values one time step after valuation for theta
+                self._V_dt = V.copy()
+                self._delta_t = dt
+            if adaptive:
+                V_old = V.copy()
+
+            theta = _get_theta(self.scheme, steps_after_date, self.rannacher_steps)
+            if (theta, dt) not in steps:
+                matrix = _get_matrix(operator, theta * dt)[::-1]
+                factors = _factor_tridiagonal(*matrix) if self.lcp == 'projection' else None
+                steps[(theta, dt)] = (matrix, factors, tuple((1 - theta) * dt * weight for weight in operator))
+            (matrix, factors, explicit) = steps[(theta, dt)]
+            if self.lcp == 'penalty':
+                # the nodes at the obstacle one time step before
+                active = inner <= obstacle
+
+            if theta < 1:
+                # the explicit part uses the values of the time step before
+                np.multiply(explicit[0], V[:-2], out=explicit_part)
+                np.multiply(explicit[1], inner, out=work)
+                explicit_part += work
+                np.multiply(explicit[2], V[2:], out=work)
+                explicit_part += work
+                inner += explicit_part
+            inner -= q * dt
             # boundary conditions
-            if self._option.phi == +1:
-                V[0] = 0
-                V[-1] = S_max
+            if self._has_schedule:
+                # Bermuda options are treated as American at the far ends of the grid
+                ahead = dates < tau
+                payments = 0.0 if isinstance(self._option, BermudaOption) else \
+                    np.sum(amounts[ahead] * np.exp(-self._option.r * (tau - dates[ahead])))
+                V[0], V[-1] = _boundary_values(tau, edges, K, self._option.r, self._option.d, q, self._option.phi,
+                                               isinstance(self._option, BermudaOption), payments)
+            else:
+                V[0], V[-1] = _boundary_values(tau, edges, K, self._option.r, self._option.d, q, self._option.phi,
+                                               self._is_american)
+            inner[0] += theta * dt * left[0] * V[0]
+            inner[-1] += theta * dt * right[-1] * V[-1]
+            if self.lcp == 'penalty':
+                _solve_penalized(*matrix, inner, obstacle, active)
             else:
-                V[0] = self._option.K
-                V[-1] = 0
+                _solve_factored(factors, inner)
 
-            V = self._adjust_for_events(t, S, V, exercise_values)
+            V = self._adjust_for_events(S, V, exercise_values)
+            steps_after_date += 1
+            if date < len(dates) and abs(tau - dates[date]) <= 1e-12 * self._option.T:
+                V = self._apply_schedule(S, V, amounts[date])
+                date += 1
+                steps_after_date = 0
+            taus.append(tau)
+            if adaptive:
+                change = self._next_time_step(V_old, V)
+
+        self._times = self._option.T - np.array(taus[::-1])
+        self._times[0] = 0.0
+        self._stop = np.array(self._stop_taus[::-1])
+        self._ex = np.array(self._ex_taus[::-1])
+        self._S_grid = S
+        self._V_grid = V
+        return np.interp(spots, S, V)
+
+    def price(self):
+        self._init_bounds()
+        return self._calc(self._option.S)
+
+    def values(self, spots):
+        """
+        Compute the values of the option for a ladder of spots from a single solve. The grid is widened
+        to cover all spots, the boundaries do not depend on the spot.
+        :param spots: array of spots
+        :return: array of values
+        """
+        spots = np.asarray(spots, dtype=float)
+        if np.any(spots <= 0):
+            raise ValueError("spots must be positive")
+        self._init_bounds()
+        return self._calc(spots)
+
+    def _bumped_price(self, **bumps):
+        """
+        Price the option with shifted parameters on the same grid without recording any boundary
+        """
+        option = copy.copy(self._option)
+        for name, bump in bumps.items():
+            setattr(option, name, getattr(option, name) + bump)
+        pricer = copy.copy(self)
+        pricer._option = option
+        pricer.track_bounds = False
+        return pricer.price()
+
+    def greeks(self, vola_bump=1e-2, rate_bump=1e-3):
+        """
+        Compute the price and its sensitivities. Delta and gamma are differentiated on the final grid,
+        theta is taken from the values one time step earlier in the same solve. Vega and rho need one additional
+        price-only solve each (forward differences).
+        :param vola_bump: shift of the volatility for vega
+        :param rate_bump: shift of the riskfree rate for rho
+        :return: dict with price, delta, gamma, theta, vega and rho
+        """
+        if self.time_steps < 2:
+            raise ValueError("greeks need at least 2 time steps")
+
+        price = self.price()
+        S = self._S_grid
+        delta_grid = np.gradient(self._V_grid, S)
+        delta = np.interp(self._option.S, S, delta_grid)
+        gamma = np.interp(self._option.S, S, np.gradient(delta_grid, S))
+        theta = (np.interp(self._option.S, S, self._V_dt) - price) / self._delta_t
+
+        vega = (self._bumped_price(vola=vola_bump) - price) / vola_bump
+        rho = (self._bumped_price(r=rate_bump) - price) / rate_bump
+        return {"price": price, "delta": delta, "gamma": gamma, "theta": theta, "vega": vega, "rho": rho}
 
-        return np.interp(self._option.S, S, V)
+class FDMBatchPricer:
+    def __init__(self, S, K, r, d, vola, T, q=0, phi=+1, american=False, space_steps=10000, time_steps=None,
+                 grid='uniform', scheme='implicit', lcp='projection', track_bounds=True):
+        """
+        Construct an FDMBatchPricer which prices a whole book of options in one pass over the time steps.
+        The PDE is solved in moneyness S/K on a grid shared by all options, the tridiagonal systems of all options
+        are stacked into one block diagonal system per time step.
+        Every option parameter may be a scalar or an array; all are broadcast to a common length.
+        :param S: spot prices
+        :param K: strike prices
+        :param r: riskfree rates
+        :param d: dividend yields
+        :param vola: volatilities
+        :param T: times to maturity
+        :param q: continuous installment rates (0 for vanilla options)
+        :param phi: option types (+1 for call, -1 for put)
+        :param american: flags for early exercise
+        :param space_steps: number of space steps, shared by all options
+        :param time_steps: number of time steps, shared by all options, each option steps through its own
+            maturity (default int(1600*max(T)))
+        :param grid: 'uniform', 'stretched' or 'log', see FDMPricer
+        :param scheme: 'implicit' or 'crank-nicolson', see FDMPricer
+        :param lcp: 'projection' or 'penalty', see FDMPricer
+        :param track_bounds: record the stop and exercise boundaries, switch off if only the prices are needed
+        """
+        (self.S, self.K, self.r, self.d, self.vola, self.T, self.q, self.phi) = np.broadcast_arrays(
+            *[np.atleast_1d(np.asarray(x, dtype=float)) for x in (S, K, r, d, vola, T, q, phi)])
+        self.american = np.broadcast_to(np.asarray(american, dtype=bool), self.S.shape)
+        self.space_steps = space_steps
+        self.time_steps = int(1600 * np.max(self.T)) if time_steps is None else time_steps
+        self.grid = grid
+        self.scheme = scheme
+        self.rannacher_steps = 2
+        self.lcp = lcp
+        self.track_bounds = track_bounds
+
+    @classmethod
+    def from_options(cls, options, **kwargs):
+        """
+        Construct an FDMBatchPricer from a list of option objects
+        :param options: options of type Option, AmericanOption or (American)ContinuousInstallmentOption
+        :param kwargs: the grid and solver settings of the constructor
+        """
+        def column(f):
+            return [f(o) for o in options]
+
+        return cls(column(lambda o: o.S), column(lambda o: o.K), column(lambda o: o.r), column(lambda o: o.d),
+                   column(lambda o: o.vola), column(lambda o: o.T),
+                   column(lambda o: o.installment_rate if hasattr(o, "installment_rate") else 0),
+                   column(lambda o: o.phi), column(lambda o: isinstance(o, AmericanOption)), **kwargs)
+
+    def _init_bounds(self):
+        self.stop_bound = np.zeros((len(self.S), self.time_steps + 1))
+        self.ex_bound = np.zeros((len(self.S), self.time_steps + 1))
+        self.stop_bound[:, -1] = self.K
+        self.ex_bound[:, -1] = self.K
+
+    def _adjust_for_events(self, t, S, V, exercise_values):
+        # the boundary nodes are fixed, only the inner nodes of the ascending grid can be events
+        inner = V[:, 1:-1]
+        stop = inner < 0
+        if np.any(self.american):
+            # out of the money nodes with negative value are stop events, not exercise events
+            exercise = (inner < exercise_values[:, 1:-1]) & (exercise_values[:, 1:-1] > 0)
+            stop &= ~exercise
+            if self.track_bounds:
+                ex_bound = find_edges(exercise, S, self.phi == +1, self.ex_bound[:, t + 1])
+                self.ex_bound[:, t] = np.where(self.american, ex_bound, self.ex_bound[:, t])
+            np.maximum(V, exercise_values, out=V)
+
+        if self.track_bounds:
+            self.stop_bound[:, t] = find_edges(stop, S, self.phi == -1, self.stop_bound[:, t + 1])
+        np.maximum(V, 0, out=V)
+        return V
 
     def price(self):
+        """
+        Price all options of the book
+        :return: array of option prices
+        """
         self._init_bounds()
-        return self._calc()
+        if self.lcp not in ('projection', 'penalty'):
+            raise TypeError(f"LCP method {self.lcp} not supported")
+
+        # the PDE in moneyness, values per unit of strike
+        def column(x):
+            return x[:, None]
+
+        r, d, phi, K = column(self.r), column(self.d), column(self.phi), column(self.K)
+        dt = column(self.T / self.time_steps)
+        q = column(self.q / self.K)
+        american = column(self.american)
+        moneyness = self.S / self.K
+        width = 0.5 * np.max(self.vola * np.sqrt(self.T))
+        m, y = _space_grid(self.grid, self.space_steps, 1.0, moneyness, width, [1.0])
+        diffusion, convection = _pde_coefficients(self.grid, m, column(self.vola), r - d)
+        operator = _get_operator(y, diffusion, convection, r)
+        (left, _, right) = operator
+
+        # exercise values of the European options are 0, their obstacle for the penalty method as well
+        exercise_values = np.maximum(phi * (m - 1), 0) * american
+        V = np.maximum(phi * (m - 1), 0)
+        S = m[1:-1] * K
+        edges = m[[0, -1]]
+        rhs = np.empty(left.shape)
+        work = np.empty(left.shape)
+        obstacle = exercise_values[:, 1:-1].ravel()
+        steps = {}
+
+        for t in range(self.time_steps - 1, -1, -1):
+            theta = _get_theta(self.scheme, self.time_steps - 1 - t, self.rannacher_steps)
+            if theta not in steps:
+                matrix = tuple(diagonal.ravel() for diagonal in _get_matrix(operator, theta * dt)[::-1])
+                factors = _factor_tridiagonal(*matrix) if self.lcp == 'projection' else None
+                steps[theta] = (matrix, factors, tuple((1 - theta) * dt * weight for weight in operator))
+            (matrix, factors, explicit) = steps[theta]
+            if self.lcp == 'penalty':
+                # the nodes at the obstacle one time step before
+                active = V[:, 1:-1].ravel() <= obstacle
+
+            np.subtract(V[:, 1:-1], q * dt, out=rhs)
+            if theta < 1:
+                # the explicit part uses the values of the time step before
+                for weight, neighbours in zip(explicit, (V[:, :-2], V[:, 1:-1], V[:, 2:])):
+                    np.multiply(weight, neighbours, out=work)
+                    rhs += work
+            # boundary conditions
+            V[:, [0, -1]] = _boundary_values((self.time_steps - t) * dt, edges, 1.0, r, d, q, phi, american)
+            rhs[:, 0] += theta * dt[:, 0] * left[:, 0] * V[:, 0]
+            rhs[:, -1] += theta * dt[:, 0] * right[:, -1] * V[:, -1]
+            if self.lcp == 'penalty':
+                _solve_penalized(*matrix, rhs.ravel(), obstacle, active)
+            else:
+                _solve_factored(factors, rhs.ravel())
+            V[:, 1:-1] = rhs
+
+            V = self._adjust_for_events(t, S, V, exercise_values)
+
+        # linear interpolation at the moneyness of each option
+        index = np.clip(np.searchsorted(m, moneyness) - 1, 0, len(m) - 2)
+        w = (moneyness - m[index]) / (m[index + 1] - m[index])
+        rows = np.arange(len(self.S))
+        return self.K * ((1 - w) * V[rows, index] + w * V[rows, index + 1])
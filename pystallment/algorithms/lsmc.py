@@ -1,93 +1,632 @@
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import numpy as np
 import numpy.random
 
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+from scipy.stats import norm, qmc
+
+from pystallment import black_scholes as bs
 from pystallment.option import AmericanOption
 
+class Regression:
+    """
+    Least squares regression of continuation values on basis functions of the moneyness.
+    The basis is 'power' or 'hermite' (physicists') in z = S/K - 1 or 'laguerre' in x = S/K, all up to degree.
+    The normal equations are solved by a Cholesky decomposition, the design matrix is kept in a buffer
+    which is reused at every time step.
+    """
+    def __init__(self, basis='laguerre', degree=3, K=1.0):
+        """
+        Construct a Regression
+        :param basis: 'power', 'hermite' or 'laguerre'
+        :param degree: the highest degree of the basis functions
+        :param K: the strike which normalises the spots
+        """
+        if basis not in ('power', 'hermite', 'laguerre'):
+            raise TypeError(f"basis {basis} not supported.")
+        self.basis = basis
+        self.degree = degree
+        self.K = K
+        self._buffer = np.empty((0, degree + 1))
+
+    def __getstate__(self):
+        # the buffer is scratch space, it is not pickled
+        state = self.__dict__.copy()
+        state['_buffer'] = np.empty((0, self.degree + 1))
+        return state
+
+    def design(self, S):
+        """
+        Evaluate the basis functions
+        :param S: array of spots
+        :return: matrix with one row per spot and one column per basis function, a view into the buffer
+        """
+        n = len(S)
+        if len(self._buffer) < n:
+            self._buffer = np.empty((n, self.degree + 1))
+        A = self._buffer[:n]
+        A[:, 0] = 1
+        if self.degree == 0:
+            return A
+        if self.basis == 'laguerre':
+            x = S / self.K
+            A[:, 1] = 1 - x
+            for k in range(1, self.degree):
+                A[:, k+1] = ((2*k + 1 - x) * A[:, k] - k * A[:, k-1]) / (k + 1)
+        else:
+            z = S / self.K - 1
+            if self.basis == 'power':
+                for k in range(self.degree):
+                    np.multiply(A[:, k], z, out=A[:, k+1])
+            else:
+                A[:, 1] = 2 * z
+                for k in range(1, self.degree):
+                    A[:, k+1] = 2 * z * A[:, k] - 2 * k * A[:, k-1]
+        return A
+
+    def fit(self, S, y):
+        """
+        Fit the continuation values
+        :param S: array of spots
+        :param y: array of discounted future cash flows
+        :return: the coefficients and the fitted values at S
+        """
+        A = self.design(S)
+        try:
+            coefficients = cho_solve(cho_factor(A.T @ A), A.T @ y)
+        except LinAlgError:
+            # fewer distinct spots than basis functions
+            coefficients = np.linalg.lstsq(A, y, rcond=None)[0]
+        return coefficients, A @ coefficients
+
+    def predict(self, coefficients, S):
+        """
+        Evaluate a fitted regression
+        :param coefficients: the coefficients of the basis functions
+        :param S: array of spots
+        :return: the continuation values at S
+        """
+        return self.design(S) @ coefficients
+
+class PathCache:
+    """
+    Store of simulated paths shared by LSMCPricers on the same underlying. The paths only depend on the market
+    parameters, the time grid, the number of paths, the seed and the sampler, strike, installment rate and
+    option type only enter through the payoff. The least recently used paths are evicted once the
+    stored paths exceed max_bytes. Stored paths are read-only. The cache is emptied when it is pickled.
+    """
+    def __init__(self, max_bytes=2**30):
+        """
+        Construct an empty PathCache
+        :param max_bytes: the maximum size of the stored paths
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._paths = OrderedDict()
+
+    def __getstate__(self):
+        # paths are not sent to worker processes
+        state = self.__dict__.copy()
+        state['nbytes'] = 0
+        state['_paths'] = OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self._paths)
+
+    def get(self, key):
+        """
+        Look up paths
+        :param key: the key of the paths
+        :return: the paths or None
+        """
+        paths = self._paths.get(key)
+        if paths is not None:
+            self._paths.move_to_end(key)
+        return paths
+
+    def put(self, key, paths):
+        """
+        Store paths, evicting the least recently used ones if the cache is full
+        :param key: the key of the paths
+        :param paths: array of paths, set to read-only
+        """
+        if key in self._paths:
+            self.nbytes -= self._paths.pop(key).nbytes
+        if paths.nbytes > self.max_bytes:
+            return
+        while self.nbytes + paths.nbytes > self.max_bytes:
+            self.nbytes -= self._paths.popitem(last=False)[1].nbytes
+        paths.flags.writeable = False
+        self._paths[key] = paths
+        self.nbytes += paths.nbytes
+
+    def clear(self):
+        self._paths.clear()
+        self.nbytes = 0
+
+class LSMCPolicy:
+    """
+    The exercise and installment stop decisions of a fitted LSMCPricer: the regression coefficients of the
+    continuation value for every decision date, keyed by the time to maturity. A policy can price fresh
+    paths without refitting, also for another spot, a shorter time to maturity or another time grid, where the
+    decision of the nearest fitted date is used.
+    """
+    def __init__(self, regression, method):
+        """
+        Construct an empty LSMCPolicy
+        :param regression: a Regression, or None for the fit methods 'hermite' and 'poly' in the spot
+        :param method: the fit method used without regression
+        """
+        self.regression = regression
+        self.method = method
+        self.exercise = {}
+        self.stop = {}
+
+    def fit(self, S, y, poly_degree):
+        """
+        Fit the continuation values
+        :param poly_degree: degree of the polynomial for method = 'poly'
+        :return: the coefficients and the fitted values at S
+        """
+        if self.regression is not None:
+            return self.regression.fit(S, y)
+        if self.method == 'hermite':
+            fitted = np.polynomial.Hermite.fit(S, y, 4)
+            return fitted, fitted(S)
+        if self.method == 'poly':
+            coefficients = np.polyfit(S, y, poly_degree)
+            return coefficients, np.polyval(coefficients, S)
+        raise TypeError(f"fit method {self.method} not supported.")
+
+    def predict(self, coefficients, S):
+        """
+        Evaluate the continuation values of a fitted step
+        :param coefficients: coefficients returned by fit
+        :param S: array of spots
+        :return: the continuation values at S
+        """
+        if self.regression is not None:
+            return self.regression.predict(coefficients, S)
+        if self.method == 'hermite':
+            return coefficients(S)
+        return np.polyval(coefficients, S)
+
+    def coefficients(self, decision, tau):
+        """
+        Look up the coefficients of a decision
+        :param decision: 'exercise' or 'stop'
+        :param tau: time to maturity
+        :return: the coefficients of the nearest fitted date, None if the decision was never fitted
+        """
+        fitted = getattr(self, decision)
+        if len(fitted) == 0:
+            return None
+        return fitted[min(fitted, key=lambda fitted_tau: abs(fitted_tau - tau))]
+
 class LSMCPricer:
     """
     LSMCPricer prices vanilla/installment options using antithetic paths.
-    It extrapolates continuation value by Hermite polynomials 
+    It extrapolates continuation value by Hermite polynomials in the spot (fit), or, if a basis is given,
+    by a Regression on basis functions of the moneyness up to degree.
+    The paths are generated by the attribute generation:
+    'forward' simulates and stores all paths from valuation to maturity,
+    'bridge' simulates the spots at maturity first and goes backwards in time with a Brownian bridge,
+    so only one time slice of the paths is kept in memory.
+    The random numbers are drawn by the attribute sampler:
+    'pseudo' draws antithetic pseudo random normals, num_paths is rounded down to an even number of paths,
+    'sobol' splits the paths into replicates of scrambled Sobol points, which are turned into paths by a
+    Brownian bridge in bisection order. The paths of a replicate are rounded down to a power of two, e.g.
+    num_paths = 100000 and replicates = 8 give 8 replicates of 8192 paths. Each replicate is priced on its
+    own, the standard error is estimated from the spread of the replicates. Sobol sampling needs
+    generation = 'forward'.
+    With control_variate = True the discounted European payoff on the same paths serves as control variate
+    with the analytic Black-Scholes value as its mean. The factor of the control is estimated from the paths,
+    the ratio of the variances without and with control is reported as variance_reduction.
+    After pricing, the decisions are kept as an LSMCPolicy in the attribute policy. Passing a policy to
+    price prices on fresh paths without any regression, which gives an out-of-sample (low biased) estimate.
+    With a PathCache in the attribute path_cache and a seed, the stored paths of forward generation are shared
+    by pricers of options on the same underlying.
+    The decisions are taken on a grid of time_steps uniform steps, or at the attribute decision_times (plus
+    maturity) if it is set. The spots are sampled exactly at these dates and the installments are accrued
+    exactly up to the stop time, so a coarse grid only restricts the decisions to its dates.
+    With richardson = True the price is extrapolated from the decision grid and the grid of every other date
+    (counted back from maturity) on the same paths, the Bermudan price converges to the American one
+    with the inverse of the number of dates.
     """
-    def __init__(self, option, num_paths = 100000, fit = 'hermite'):
+    def __init__(self, option, num_paths = 100000, fit = 'hermite', generation = 'forward', basis = None, degree = 3,
+                 sampler = 'pseudo', replicates = 8, control_variate = False, richardson = False):
         self._option = option
-        self.num_paths = int(num_paths)
+        # the pseudo random paths come in antithetic pairs
+        self.num_paths = 2 * max(int(num_paths / 2), 1)
         self.time_steps = int(self._option.T*320)
+        self.decision_times = None
         self.fit = fit
+        self.generation = generation
+        self.basis = basis
+        self.degree = degree
+        self.sampler = sampler
+        self.replicates = replicates
+        self.control_variate = control_variate
+        self.richardson = richardson
         self.seed = None
+        self.path_cache = None
+        self.std_error = None
+        self.variance_reduction = None
+        self.policy = None
         self._is_american = isinstance(self._option, AmericanOption)
 
-    def _generate_paths(self):
-        rng = numpy.random.default_rng(self.seed)
+    @property
+    def times(self):
+        """
+        Returns the time grid of the decisions.
+
+        :return: Times from valuation to maturity.
+        """
+        return self._times
+
+    def _time_grid(self):
+        T = self._option.T
+        if self.decision_times is None:
+            return np.linspace(0, T, self.time_steps + 1)
+        times = np.unique(np.asarray(self.decision_times, dtype=float))
+        return np.concatenate(([0], times[(times > 0) & (times < T)], [T]))
 
-        self.paths = np.zeros((self.num_paths, self.time_steps + 1))
-        self.dt = self._option.T / self.time_steps
+    def _cache_key(self, seed):
+        """
+        :return: the key of the paths in the path cache, None if the paths are not reproducible
+        """
+        # without a seed of the pricer the seed of the paths is drawn internally and never recurs
+        if self.path_cache is None or self.seed is None or seed is None:
+            return None
+        if isinstance(seed, np.random.SeedSequence):
+            seed = (seed.entropy, seed.spawn_key)
+        o = self._option
+        return (o.S, o.r, o.d, o.vola, tuple(self._times), self.num_paths, seed, self.sampler)
 
-        alpha = (self._option.r-self._option.d - 0.5*self._option.vola**2)*self.dt
-        beta = self._option.vola*np.sqrt(self.dt)
+    def _generate_paths(self, seed):
+        key = self._cache_key(seed)
+        if key is not None:
+            self.paths = self.path_cache.get(key)
+            if self.paths is not None:
+                return
+        self._simulate_paths(seed)
+        if key is not None:
+            self.path_cache.put(key, self.paths)
 
+    def _simulate_paths(self, seed):
+        rng = numpy.random.default_rng(seed)
+        num_steps = len(self._times) - 1
+
+        self.paths = np.zeros((self.num_paths, num_steps + 1))
         self.paths[:, 0] = self._option.S
+        drift = (self._option.r-self._option.d - 0.5*self._option.vola**2) * self._times[1:]
+        if self.sampler == 'sobol':
+            self._generate_sobol_paths(rng, drift)
+            return
 
         n = int(self.num_paths/2)
-        E = rng.normal(size=(n, self.time_steps))
-        E = np.cumsum(E, axis = 1)
-        O = np.ones((n, self.time_steps))
-        O = np.cumsum(O, axis = 1)
-        self.paths[:n, 1:] = self._option.S * np.exp( alpha*O + beta*E )
-        self.paths[n:, 1:] = self._option.S * np.exp(alpha * O - beta * E)
+        E = rng.normal(size=(n, num_steps))
+        E *= self._option.vola * np.sqrt(np.diff(self._times))
+        np.cumsum(E, axis=1, out=E)
+        self.paths[:n, 1:] = self._option.S * np.exp(drift + E)
+        self.paths[n:, 1:] = self._option.S * np.exp(drift - E)
+
+    def _generate_sobol_paths(self, rng, drift):
+        """
+        Turn scrambled Sobol points into paths with a Brownian bridge in bisection order, so the first
+        (best distributed) coordinates determine the spot at maturity and the coarse shape of the paths.
+        """
+        t = self._times
+        num_steps = len(t) - 1
+        U = qmc.Sobol(d=num_steps, scramble=True, seed=rng).random(self.num_paths)
+        Z = norm.ppf(np.clip(U, 1e-12, 1 - 1e-12))
+        W = np.zeros((self.num_paths, num_steps + 1))
+        W[:, -1] = np.sqrt(t[-1]) * Z[:, 0]
+        for k, (m, left, right) in enumerate(_bisection(num_steps), start=1):
+            mean = ((t[right] - t[m]) * W[:, left] + (t[m] - t[left]) * W[:, right]) / (t[right] - t[left])
+            std = np.sqrt((t[m] - t[left]) * (t[right] - t[m]) / (t[right] - t[left]))
+            W[:, m] = mean + std * Z[:, k]
+        self.paths[:, 1:] = self._option.S * np.exp(drift + self._option.vola * W[:, 1:])
 
-    def price(self):
-        self._generate_paths()
-        payoffs = self._option.payoff(self.paths)
+    def _bridge_slices(self, seed):
+        """
+        Generate the spots of all paths backwards from maturity with a Brownian bridge: given the Brownian motion
+        W at time t[k+1], W at time t[k] is normal with mean W*t[k]/t[k+1] and variance t[k]*(t[k+1]-t[k])/t[k+1].
+        """
+        rng = numpy.random.default_rng(seed)
+        t = self._times
+        mu = self._option.r - self._option.d - 0.5*self._option.vola**2
 
+        n = int(self.num_paths/2)
+        W = rng.normal(size=n) * np.sqrt(t[-1])
+        S = np.empty(self.num_paths)
+        for k in range(len(t) - 1, 0, -1):
+            if k < len(t) - 1:
+                W *= t[k] / t[k + 1]
+                W += rng.normal(size=n) * np.sqrt(t[k] * (t[k + 1] - t[k]) / t[k + 1])
+            np.exp(mu * t[k] + self._option.vola * W, out=S[:n])
+            np.exp(mu * t[k] - self._option.vola * W, out=S[n:])
+            S *= self._option.S
+            yield k, S
+
+    def _path_slices(self, seed, reuse=False):
+        """
+        Generate the spots of all paths at each date, backwards from maturity to the first date
+        :param seed: the seed of the paths
+        :param reuse: use the stored paths of the last forward generation
+        """
+        if self.generation == 'forward':
+            if not reuse:
+                self._generate_paths(seed)
+            for k in range(len(self._times) - 1, 0, -1):
+                yield k, self.paths[:, k]
+        elif self.generation == 'bridge':
+            yield from self._bridge_slices(seed)
+        else:
+            raise TypeError(f"path generation {self.generation} not supported.")
+
+    def _continuation_value(self, policy, refit, decision, t, S, y, index, poly_degree):
+        """
+        Regress the discounted cash flows y on the spots S of the paths in index and store the coefficients
+        in the policy, or evaluate the policy without refitting
+        :param decision: 'exercise' or 'stop'
+        :param poly_degree: degree of the polynomial for fit = 'poly'
+        :return: the continuation values of the paths in index, None if there is no path or the policy has no
+            decision
+        """
+        if len(index) == 0:
+            return None
+        tau = self._option.T - t
+        if not refit:
+            coefficients = policy.coefficients(decision, tau)
+            return None if coefficients is None else policy.predict(coefficients, S[index])
+        coefficients, fitted = policy.fit(S[index], y[index], poly_degree)
+        getattr(policy, decision)[tau] = coefficients
+        return fitted
+
+    def price(self, policy=None):
+        """
+        Price the option
+        :param policy: an LSMCPolicy to decide with, None fits the decisions on the paths
+        :return: the price
+        """
+        if self.sampler == 'sobol':
+            return self._price_replicates(policy)
+        if self.sampler != 'pseudo':
+            raise TypeError(f"sampler {self.sampler} not supported.")
+
+        y = self._cash_flows(policy)
+        # the antithetic pairs are independent
+        n = int(self.num_paths/2)
+        self._samples = n
+        pairs = 0.5 * (y[:n] + y[n:2*n])
+        if self.control_variate:
+            control = 0.5 * (self._control[:n] + self._control[n:2*n])
+            corrected = pairs - _control_factor(pairs, control) * (control - self._european_value())
+            self.variance_reduction = np.var(pairs) / np.var(corrected)
+            pairs = corrected
+        self.std_error = np.std(pairs, ddof=1) / np.sqrt(n)
+        return np.mean(pairs)
+
+    def _price_replicates(self, policy):
+        if self.generation != 'forward':
+            raise TypeError("sobol sampling needs generation 'forward'.")
+        seeds = _seed_sequence(self.seed).spawn(self.replicates)
+        # Sobol points keep their balance properties only in powers of two
+        num_paths = 2 ** int(np.log2(max(self.num_paths // self.replicates, 1)))
+        pricers = [self._chunk_pricer(num_paths, seed) for seed in seeds]
+        flows = [pricer._cash_flows(policy) for pricer in pricers]
+        # the policy of the first replicate is kept
+        self.policy = pricers[0].policy
+        prices = np.array([np.mean(y) for y in flows])
+        if self.control_variate:
+            # the factor is estimated on all paths, a few replicates are too few for it
+            beta = _control_factor(np.concatenate(flows), np.concatenate([pricer._control for pricer in pricers]))
+            controls = np.array([np.mean(pricer._control) for pricer in pricers])
+            corrected = prices - beta * (controls - self._european_value())
+            self.variance_reduction = np.var(prices) / np.var(corrected)
+            prices = corrected
+        self._samples = self.replicates
+        self.std_error = np.std(prices, ddof=1) / np.sqrt(self.replicates)
+        return np.mean(prices)
+
+    def _cash_flows(self, policy=None):
+        """
+        Run the backward induction on one set of paths
+        :param policy: an LSMCPolicy to decide with, None fits a new one into self.policy
+        :return: the discounted cash flows of all paths
+        """
+        self._times = self._time_grid()
+        if not self.richardson:
+            return self._backward_induction(policy, self.seed, 1)
+        # both decision grids are priced on the same paths, the fine grid is priced last to keep its policy
+        seed = self.seed if self.seed is not None else np.random.SeedSequence().entropy
+        coarse = self._backward_induction(policy, seed, 2)
+        fine = self._backward_induction(policy, seed, 1, reuse=True)
+        return 2 * fine - coarse
+
+    def _backward_induction(self, policy, seed, stride, reuse=False):
+        """
+        Run the backward induction on one set of paths
+        :param policy: an LSMCPolicy to decide with, None fits a new one into self.policy
+        :param seed: the seed of the paths
+        :param stride: decide at every stride-th date, counted back from maturity
+        :param reuse: use the stored paths of the last forward generation
+        :return: the discounted cash flows of all paths
+        """
         q = 0
         if hasattr(self._option, "installment_rate"):
             q = self._option.q
+        refit = policy is None
+        if refit:
+            regression = None
+            if self.basis is not None:
+                regression = Regression(self.basis, self.degree, self._option.final_strike)
+            policy = LSMCPolicy(regression, self.fit)
+        self.policy = policy
 
-        V = payoffs[:, -1]
-        stop_times = np.ones(self.num_paths) * self.time_steps
-        for t in range(self.time_steps, 0, -1):
-            itm = payoffs[:, t] > 0
-            _df = np.exp(-self._option.r * self.dt * (stop_times - t))
-            y = _df * V - q / self._option.r * (1 - _df)
+        V = None
+        y = None
+        last = len(self._times) - 1
+        stop_times = np.full(self.num_paths, float(self._option.T))
+        for k, S in self._path_slices(seed, reuse):
+            if (last - k) % stride != 0:
+                continue
+            t = self._times[k]
+            payoff = self._option.payoff(S)
+            if V is None:
+                V = payoff.copy()
+                self._control = np.exp(-self._option.r * self._option.T) * payoff
+            itm = payoff > 0
+            if refit:
+                # the discounted cash flows are only needed as regression targets
+                _df = np.exp(-self._option.r * (stop_times - t))
+                y = _df * V - q / self._option.r * (1 - _df)
 
             if self._is_american:
-                S_itm = self.paths[itm, t]
-                y_itm = y[itm]
-                if len(S_itm) > 0:
-                    if self.fit == 'hermite':
-                        fitted = np.polynomial.Hermite.fit(S_itm, y_itm, 4)
-                        continuation_value = fitted(S_itm)
-                    elif self.fit == 'poly':
-                        regression = np.polyfit(S_itm, y_itm, 2)
-                        continuation_value = np.polyval(regression, S_itm)
-                    else:
-                        raise TypeError(f"fit method {self.fit} not supported.")
-
+                index = np.flatnonzero(itm)
+                continuation_value = self._continuation_value(policy, refit, 'exercise', t, S, y, index, 2)
+                if continuation_value is not None:
                     # Entscheidung: Ausüben oder Fortführen
-                    exercise = payoffs[itm, t] > continuation_value
-                    stop_times[itm] = np.where(exercise, t, stop_times[itm])
-                    V[itm] = np.where(exercise, payoffs[itm, t], V[itm])
+                    index = index[payoff[index] > continuation_value]
+                    stop_times[index] = t
+                    V[index] = payoff[index]
 
             if np.abs(q) > 1e-12:
-                oom = ~itm
-                S_oom = self.paths[oom, t]
-                y_oom = y[oom]
-                if len(S_oom) > 0:
-                    if self.fit == 'hermite':
-                        fitted = np.polynomial.Hermite.fit(S_oom, y_oom, 4)
-                        continuation_value = fitted(S_oom)
-
-                    if self.fit == 'poly':
-                        regression = np.polyfit(S_oom, y_oom, 3)
-                        continuation_value = np.polyval(regression, S_oom)
-
+                index = np.flatnonzero(~itm)
+                continuation_value = self._continuation_value(policy, refit, 'stop', t, S, y, index, 3)
+                if continuation_value is not None:
                     # Entscheidung: Fortführen oder Stoppen der Ratenzahlung
-                    stop = continuation_value <= 0
-                    stop_times[oom] = np.where(stop, t, stop_times[oom])
-                    V[oom] = np.where(stop, 0, V[oom])
-
-        # Diskontierter Erwartungswert am Anfang
-        _df = np.exp(-self._option.r*self.dt*stop_times)
-        y = _df*V - q/self._option.r*(1-_df)
-        option_price = np.mean(y)
-        return option_price
+                    index = index[continuation_value <= 0]
+                    stop_times[index] = t
+                    V[index] = 0
+
+        # Diskontierter Erwartungswert am Anfang, die Raten laufen bis zum Stoppzeitpunkt
+        _df = np.exp(-self._option.r*stop_times)
+        return _df*V - q/self._option.r*(1-_df)
+
+    def _european_value(self):
+        # the analytic mean of the control variate
+        o = self._option
+        return bs.option_value(o.S, o.final_strike, o.r, o.d, o.vola, o.T, o.phi)
+
+    def _chunk_pricer(self, num_paths, seed):
+        pricer = LSMCPricer(self._option, num_paths, self.fit, self.generation, self.basis, self.degree,
+                            self.sampler, self.replicates, self.control_variate, self.richardson)
+        pricer.time_steps = self.time_steps
+        pricer.decision_times = self.decision_times
+        pricer.seed = seed
+        pricer.path_cache = self.path_cache
+        return pricer
+
+    def price_parallel(self, processes=None, num_chunks=None, policy=None):
+        """
+        Price the option with the paths split into chunks, which are priced in a pool of processes. Every chunk
+        fits its own regressions on an independent random stream spawned from the seed, so the result
+        only depends on the seed and the number of chunks.
+        :param processes: number of processes (default: number of cores), 1 prices the chunks serially
+        :param num_chunks: number of chunks (default: processes)
+        :param policy: an LSMCPolicy shared by all chunks, None fits the decisions in every chunk
+        :return: the price and its standard error
+        """
+        processes = os.cpu_count() if processes is None else processes
+        num_chunks = processes if num_chunks is None else num_chunks
+        # each chunk needs an even number of paths for the antithetic pairs
+        chunk_paths = 2 * max(int(self.num_paths / (2 * num_chunks)), 1)
+        seeds = _seed_sequence(self.seed).spawn(num_chunks)
+        pricers = [self._chunk_pricer(chunk_paths, seed) for seed in seeds]
+        if processes == 1:
+            results = [_price_chunk(pricer, policy) for pricer in pricers]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_price_chunk, pricers, repeat(policy)))
+
+        price, self.std_error = _pool(results)
+        return price, self.std_error
+
+    def price_to_tolerance(self, atol=1e-2, rtol=0.0, time_budget=None, batch_paths=2**14, max_paths=2**22,
+                           policy=None):
+        """
+        Price the option in batches of paths until the standard error of the running estimate is within
+        max(atol, rtol*|price|), the time budget is spent or max_paths are simulated. Every batch fits its own
+        regressions on an independent random stream spawned from the seed. The number of simulated paths is
+        stored in converged_paths.
+        :param atol: absolute tolerance of the standard error
+        :param rtol: relative tolerance of the standard error
+        :param time_budget: wall time in seconds after which no further batch is started, None for no limit
+        :param batch_paths: number of paths per batch, rounded down to an even number for the antithetic pairs
+        :param max_paths: no batch is started beyond this number of paths, even if the tolerance is not met
+        :param policy: an LSMCPolicy shared by all batches, None fits the decisions in every batch
+        :return: the price
+        """
+        start = time.perf_counter()
+        seeds = _seed_sequence(self.seed)
+        results = []
+        self.converged_paths = 0
+        # each batch needs an even number of paths for the antithetic pairs
+        batch_paths = 2 * max(int(batch_paths / 2), 1)
+        while True:
+            pricer = self._chunk_pricer(batch_paths, seeds.spawn(1)[0])
+            results.append(_price_chunk(pricer, policy))
+            self.converged_paths += pricer.num_paths
+            price, self.std_error = _pool(results)
+            if self.std_error <= max(atol, rtol * abs(price)) or self.converged_paths + batch_paths > max_paths:
+                break
+            if time_budget is not None and time.perf_counter() - start >= time_budget:
+                break
+        return price
+
+def _seed_sequence(seed):
+    # the pricers of chunks and replicates are seeded with a SeedSequence spawned from the seed
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+def _price_chunk(pricer, policy):
+    # runs in a worker process
+    price = pricer.price(policy)
+    return price, pricer.std_error, pricer._samples
+
+def _pool(results):
+    """
+    Pool the statistics of the independent samples (antithetic pairs or replicates) of several chunks
+    :param results: list of the price, standard error and number of samples of each chunk
+    :return: the pooled price and its standard error
+    """
+    prices, errors, samples = (np.array(x) for x in zip(*results))
+    price = np.sum(samples * prices) / np.sum(samples)
+    variance = (np.sum((samples - 1) * samples * errors**2) + np.sum(samples * (prices - price)**2)) \
+        / (np.sum(samples) - 1)
+    return price, np.sqrt(variance / np.sum(samples))
+
+def _control_factor(y, control):
+    """
+    Variance minimising factor of a control variate
+    :param y: samples of the estimator
+    :param control: samples of the control on the same paths
+    :return: cov(y, control) / var(control)
+    """
+    c = control - np.mean(control)
+    variance = np.dot(c, c)
+    return np.dot(y - np.mean(y), c) / variance if variance > 0 else 0.0
+
+def _bisection(num_steps):
+    """
+    Order in which a Brownian bridge fills the steps between 0 and num_steps by bisection
+    :return: list of (step, left, right), the step is filled from the known steps left and right
+    """
+    order = []
+    intervals = [(0, num_steps)]
+    while intervals:
+        refined = []
+        for left, right in intervals:
+            if right - left > 1:
+                m = (left + right) // 2
+                order.append((m, left, right))
+                refined += [(left, m), (m, right)]
+        intervals = refined
+    return order
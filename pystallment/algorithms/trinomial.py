@@ -0,0 +1,138 @@
+import numpy as np
+
+from pystallment.option import AmericanOption
+from pystallment.algorithms.boundary import find_edge
+
+class TrinomialPricer:
+    """
+    Class TrinomialPricer calculates the price of a European/American vanilla/installment option
+    on a trinomial lattice in log spot. The space step is adjusted such that the strike lies on a node
+    of the finest mesh.
+    With refine_levels > 0 an adaptive mesh (Figlewski and Gao) refines the last time step: every level
+    halves the space step and quarters the time step over the last step of the level before. This is where
+    the kink of the payoff at the strike and the jump of the stop boundary at maturity sit.
+    The refinement is not localized in space: unlike the original model, whose fine meshes only cover a few
+    nodes around the strike and the boundaries, every level spans the whole width of the lattice. A level only
+    adds O(num_steps) nodes, which costs less than tracking where the fine mesh has to end.
+    """
+    def __init__(self, option, num_steps=500, refine_levels=0, track_bounds=True):
+        """
+        Construct a TrinomialPricer
+        :param option: option of type AmericanOption or ContinuousInstallmentOption
+        :param num_steps: number of coarse time steps
+        :param refine_levels: number of mesh refinements of the last time step
+        :param track_bounds: record the stop and exercise boundaries, switch off if only the price is needed
+        """
+        self.num_steps = num_steps
+        self.refine_levels = refine_levels
+        self.track_bounds = track_bounds
+        self._option = option
+        self._is_american = isinstance(option, AmericanOption)
+
+    @property
+    def times(self):
+        """
+        Returns the (non-uniform) time grid on which the boundaries are recorded.
+
+        :return: Times from valuation to maturity.
+        """
+        return self._times
+
+    def _level_steps(self):
+        # number of time steps on each mesh level, the last step of each level is refined by the next one
+        if self.refine_levels == 0:
+            return [self.num_steps]
+        return [self.num_steps - 1] + [3] * (self.refine_levels - 1) + [4]
+
+    def _init_bounds(self, num_times):
+        self.stop_bound = np.zeros(num_times)
+        self.ex_bound = np.zeros(num_times)
+        self.stop_bound[-1] = self._option.K
+        self.ex_bound[-1] = self._option.K
+        self._stop_node = None
+        self._ex_node = None
+
+    def _get_space_step(self, dt):
+        dx = self._option.vola * np.sqrt(3 * dt)
+        # put the strike on a node of the finest mesh, the middle probability stays positive for steps
+        # down to dx/sqrt(2)
+        log_strike = np.log(self._option.K / self._option.S) * 2**self.refine_levels
+        ratio = abs(log_strike) / dx
+        candidates = [abs(log_strike) / m for m in {int(np.floor(ratio)), int(np.ceil(ratio))}
+                      if m > 0 and abs(log_strike) / m >= dx / np.sqrt(2)]
+        if len(candidates) == 0:
+            return dx
+        return min(candidates, key=lambda step: abs(np.log(step / dx)))
+
+    def _get_probabilities(self, dt, dx):
+        nu = self._option.r - self._option.d - 0.5 * self._option.vola**2
+        var = (self._option.vola**2 * dt + nu**2 * dt**2) / dx**2
+        pu = 0.5 * (var + nu * dt / dx)
+        pd = 0.5 * (var - nu * dt / dx)
+        return (pu, 1 - pu - pd, pd)
+
+    def _check_stop_event(self, k, V, S, width):
+        # the nodes are ordered by ascending spot, node m sits at index m + width
+        exercise_value = self._option.payoff(S) if self._is_american else None
+        if self.track_bounds:
+            # the events are searched near the edges of the step before, on the values before the projection
+            if self._is_american:
+                # out of the money nodes with negative value are stop events, not exercise events
+                guess = None if self._ex_node is None else self._ex_node + width
+                index = find_edge(V, exercise_value, guess, lower=self._option.phi == -1,
+                                  intrinsic=exercise_value, in_the_money=True)
+                self._ex_node = None if index is None else index - width
+                self.ex_bound[k] = S[index] if index is not None else self.ex_bound[k + 1]
+            guess = None if self._stop_node is None else self._stop_node + width
+            index = find_edge(V, 0.0, guess, lower=self._option.phi == +1,
+                              intrinsic=exercise_value, in_the_money=False)
+            self._stop_node = None if index is None else index - width
+            self.stop_bound[k] = S[index] if index is not None else self.stop_bound[k + 1]
+
+        if self._is_american:
+            np.maximum(V, exercise_value, out=V)
+        np.maximum(V, 0, out=V)
+        return V
+
+    def price(self):
+        h = self._option.T / self.num_steps
+        dx = self._get_space_step(h)
+        steps = self._level_steps()
+
+        q = 0
+        if hasattr(self._option, "installment_rate"):
+            q = self._option.installment_rate
+
+        # time grid and the half width of the lattice at the end of each level
+        dts = np.concatenate([np.full(n, h / 4**level) for level, n in enumerate(steps)])
+        self._times = np.concatenate(([0], np.cumsum(dts)))
+        self._times[-1] = self._option.T
+        self._init_bounds(len(self._times))
+        width = 0
+        for level, n in enumerate(steps):
+            width = 2 * width + n if level > 0 else n
+
+        k = len(self._times) - 1
+        S = self._option.S * np.exp(np.arange(-width, width + 1) * dx / 2**self.refine_levels)
+        V = self._option.payoff(S)
+        for level in range(self.refine_levels, -1, -1):
+            dt = h / 4**level
+            pu, pm, pd = self._get_probabilities(dt, dx / 2**level)
+            df = np.exp(-self._option.r * dt)
+            qi = q / self._option.r * (1 - df)
+            for _ in range(steps[level]):
+                width -= 1
+                k -= 1
+                S = S[1:-1]
+                V = df * (pu * V[2:] + pm * V[1:-1] + pd * V[:-2]) - qi
+                V = self._check_stop_event(k, V, S, width)
+
+            if level > 0:
+                # continue on the coarser mesh of the level before
+                V = V[::2]
+                S = S[::2]
+                width //= 2
+                self._ex_node = None if self._ex_node is None else self._ex_node // 2
+                self._stop_node = None if self._stop_node is None else self._stop_node // 2
+
+        return V[0]
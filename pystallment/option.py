@@ -76,6 +76,17 @@ class Option:
         """
         return self.T
 
+    @property
+    def final_strike(self):
+        """
+        Returns the strike price at maturity, the last one for options with a schedule of strikes.
+
+        :return: Strike price at maturity.
+        """
+        if hasattr(self.K, "__getitem__"):
+            return self.K[-1]
+        return self.K
+
     def __repr__(self):
         """
         Returns a detailed string representation of the Option object for debugging purposes.
@@ -111,11 +122,7 @@ class Option:
         :param x: Price(s) at which the option payoff is evaluated.
         :return: Payoff price(s).
         """
-        if hasattr(self.K, "__get_item__"):
-            X = self.K[-1]
-        else:
-            X = self.K
-        return np.maximum(self.phi * (x - X), 0)
+        return np.maximum(self.phi * (x - self.final_strike), 0)
 
 class ContinuousInstallmentOption(Option):
     def __init__(self, S, K, r, d, vola, T, q, phi):
@@ -1,5 +1,6 @@
 import pytest
 import time
+import numpy as np
 
 from pystallment.algorithms import binomial as bp
 from pystallment import black_scholes as bs, option as opt
@@ -74,3 +75,123 @@ def test_installment_call_ciurlia(vola, S, T, q, CNFD):
     print(f"val = {val:.3f}, diff = {(val-CNFD)*100/max(val, CNFD):.3f} %")
     assert val == pytest.approx(CNFD, abs=1e-2)
 
+
+@pytest.mark.parametrize("phi", [-1, +1])
+def test_compact_lattice(phi):
+    option = opt.AmericanContinuousInstallmentOption(100, 100, 0.05, 0.04, 0.2, 1, 3, phi=phi)
+    full = bp.BinomialPricer(option, num_steps=500, lattice='full')
+    compact = bp.BinomialPricer(option, num_steps=500, lattice='compact')
+    assert compact.price() == pytest.approx(full.price(), rel=1e-12)
+    assert compact.stop_bound == pytest.approx(full.stop_bound, rel=1e-12)
+    assert compact.ex_bound == pytest.approx(full.ex_bound, rel=1e-12)
+
+def test_batch_pricer():
+    options = [
+        opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1, phi=-1),
+        opt.AmericanOption(105, 100, 0.1, 0.04, 0.2, 1, phi=+1),
+        opt.Option(100, 100, 0.05, 0.0, 0.3, 0.5, phi=+1),
+        opt.ContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1, 3, phi=+1),
+        opt.AmericanContinuousInstallmentOption(104, 100, 0.05, 0.04, 0.2, 1, 8, phi=+1),
+    ]
+    batch = bp.BinomialBatchPricer.from_options(options, num_steps=400)
+    prices = batch.price()
+    for i, option in enumerate(options):
+        pricer = bp.BinomialPricer(option, num_steps=400)
+        assert prices[i] == pytest.approx(pricer.price(), rel=1e-10)
+        assert batch.stop_bound[i] == pytest.approx(pricer.stop_bound, rel=1e-10)
+        assert batch.ex_bound[i] == pytest.approx(pricer.ex_bound, rel=1e-10)
+
+@pytest.mark.parametrize("phi, stop, ex", [(+1, 78.67, 128.84), (-1, 127.22, 82.22)])
+def test_american_installment_bounds(phi, stop, ex):
+    option = opt.AmericanContinuousInstallmentOption(100, 100, 0.05, 0.04, 0.2, 1, 3, phi=phi)
+    pricer = bp.BinomialPricer(option, num_steps=1000)
+    pricer.price()
+    # the stop region lies out of the money, the exercise projection must not hide it
+    assert pricer.stop_bound[0] == pytest.approx(stop, abs=0.05)
+    assert pricer.ex_bound[0] == pytest.approx(ex, abs=0.05)
+    assert np.all(phi * (pricer.ex_bound[:-1] - pricer.stop_bound[:-1]) > 0)
+
+    batch = bp.BinomialBatchPricer.from_options([option], num_steps=1000)
+    batch.price()
+    assert batch.stop_bound[0] == pytest.approx(pricer.stop_bound, rel=1e-12)
+    assert batch.ex_bound[0] == pytest.approx(pricer.ex_bound, rel=1e-12)
+
+def test_american_put_bounds():
+    option = opt.AmericanOption(100, 100, 0.05, 0.0, 0.2, 1, phi=-1)
+    pricer = bp.BinomialPricer(option, num_steps=500)
+    price = pricer.price()
+    # the exercise boundary of a put rises monotonically towards the strike
+    assert pricer.ex_bound[0] == pytest.approx(81.2, abs=0.5)
+    assert np.all(np.diff(pricer.ex_bound) > -1.0)
+
+    price_only = bp.BinomialPricer(option, num_steps=500, track_bounds=False)
+    assert price_only.price() == pytest.approx(price, rel=1e-14)
+
+@pytest.mark.parametrize("S, r, d, expected", td.std_american_put)
+@pytest.mark.parametrize("num_steps, kwargs", [
+    (100, {'smoothing': True, 'richardson': True}),
+    (101, {'factor_adjustment': 'lr', 'richardson': True}),
+    ])
+def test_american_put_fast_convergence(S, r, d, expected, num_steps, kwargs):
+    option = opt.AmericanOption(S, 100, r, d, 0.2, 1, phi=-1)
+    pricer = bp.BinomialPricer(option, num_steps=num_steps, **kwargs)
+    assert pricer.price() == pytest.approx(expected, rel=1e-3)
+
+@pytest.mark.parametrize("phi", [-1, +1])
+def test_euro_option_leisen_reimer(phi):
+    option = opt.Option(95, 100, 0.05, 0.04, 0.2, 1, phi=phi)
+    pricer = bp.BinomialPricer(option, num_steps=101, factor_adjustment='lr')
+    expected = bs.option_value(95, 100, 0.05, 0.04, 0.2, 1, phi)
+    assert pricer.price() == pytest.approx(expected, rel=1e-5)
+
+def _bs_greeks(S, K, r, d, vola, T, phi):
+    def value(S=S, r=r, vola=vola, T=T):
+        return bs.option_value(S, K, r, d, vola, T, phi)
+    h = 1e-4
+    return {
+        "price": value(),
+        "delta": (value(S=S+h) - value(S=S-h)) / (2*h),
+        "gamma": (value(S=S+1e-2) - 2*value() + value(S=S-1e-2)) / 1e-4,
+        "theta": (value(T=T-h) - value(T=T+h)) / (2*h),
+        "vega": (value(vola=vola+h) - value(vola=vola-h)) / (2*h),
+        "rho": (value(r=r+h) - value(r=r-h)) / (2*h),
+    }
+
+@pytest.mark.parametrize("phi", [-1, +1])
+def test_euro_greeks(phi):
+    option = opt.Option(100, 100, 0.05, 0.02, 0.2, 1, phi=phi)
+    greeks = bp.BinomialPricer(option, num_steps=500, smoothing=True, richardson=True).greeks()
+    expected = _bs_greeks(100, 100, 0.05, 0.02, 0.2, 1, phi)
+    for name in expected:
+        assert greeks[name] == pytest.approx(expected[name], rel=1e-2, abs=1e-3)
+
+@pytest.mark.parametrize("S, r, d, expected", td.std_american_put[:6])
+def test_american_put_to_tolerance(S, r, d, expected):
+    option = opt.AmericanOption(S, 100, r, d, 0.2, 1, phi=-1)
+    pricer = bp.BinomialPricer(option, smoothing=True, richardson=True)
+    price = pricer.price_to_tolerance(atol=1e-4)
+    assert price == pytest.approx(expected, rel=1e-3)
+    assert pricer.error_estimate <= 1e-4
+    assert pricer.converged_steps <= 3200
+
+@pytest.mark.parametrize("option", [
+    opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1, phi=-1),
+    opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1, 3, phi=+1),
+    opt.ContinuousInstallmentOption(104, 100, 0.05, 0.04, 0.3, 1, 8, phi=+1),
+    ])
+def test_truncated_tree(option):
+    full = bp.BinomialPricer(option, num_steps=2000)
+    truncated = bp.BinomialPricer(option, num_steps=2000, truncation=6)
+    assert truncated.price() == pytest.approx(full.price(), rel=1e-8)
+    assert truncated.stop_bound == pytest.approx(full.stop_bound, rel=1e-10)
+    assert truncated.ex_bound == pytest.approx(full.ex_bound, rel=1e-10)
+
+@pytest.mark.parametrize("richardson, max_steps", [(False, 1000), (True, 60), (True, 1000)])
+def test_price_to_tolerance_max_steps(richardson, max_steps):
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1, phi=-1)
+    pricer = bp.BinomialPricer(option, richardson=richardson)
+    # the tolerance is unreachable, the depth stops at the limit
+    price = pricer.price_to_tolerance(atol=1e-12, max_steps=max_steps)
+    assert pricer.converged_steps <= max_steps
+    assert pricer.error_estimate > 1e-12
+    assert price == pytest.approx(9.755163939182946, rel=1e-2)
@@ -0,0 +1,30 @@
+import pytest
+import numpy as np
+
+from pystallment.algorithms.boundary import find_edge
+
+@pytest.mark.parametrize("n, k", [(1, 0), (10, 0), (10, 4), (10, 9), (100, 37), (100, 99), (1000, 613)])
+def test_find_edge(n, k):
+    # the events are the nodes with negative value
+    V = np.where(np.arange(n) <= k, -1.0, 1.0)
+    for guess in [None, 0, k, n - 1, max(k - 20, 0), min(k + 20, n - 1)]:
+        assert find_edge(V, 0.0, guess, lower=True) == k
+        assert find_edge(V[::-1].copy(), 0.0, None if guess is None else n - 1 - guess, lower=False) == n - 1 - k
+
+def test_find_edge_no_event():
+    V = np.ones(50)
+    assert find_edge(V, 0.0, None) is None
+    assert find_edge(V, 0.0, 25) is None
+    assert find_edge(V, 0.0, 25, lower=False) is None
+
+def test_find_edge_conditions():
+    # a put: in the money below the strike, the value touches the payoff up to node 3
+    S = np.linspace(80, 120, 41)
+    payoff = np.maximum(100 - S, 0)
+    V = np.where(np.arange(41) <= 3, payoff, payoff + 0.5)
+    V[25:] = -0.1
+    assert find_edge(V, payoff, 10, strict=True, intrinsic=payoff, in_the_money=True) is None
+    assert find_edge(V, payoff, 10, strict=False, intrinsic=payoff, in_the_money=True) == 3
+    # the negative values out of the money are stop events, anchored at the upper end
+    assert find_edge(V, 0.0, 30, lower=False, intrinsic=payoff, in_the_money=False) == 25
+    assert find_edge(V, payoff, 30, lower=False, intrinsic=payoff, in_the_money=True) is None
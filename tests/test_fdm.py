@@ -1,7 +1,10 @@
 import pytest
+import numpy as np
+from scipy.linalg import solve_banded
+from scipy.stats import norm
 
 from pystallment.algorithms import fdm as fdm
-from pystallment import option as opt
+from pystallment import black_scholes as bs, option as opt
 import test_data as td
 
 @pytest.mark.skip
@@ -66,4 +69,256 @@ def test_installment_call_ciurlia(vola, S, T, q, CNFD):
     pricer = fdm.FDMPricer(option)
     val = pricer.price()
     print(f"FDM = {val:.3f}, diff = {(val-CNFD)*100/max(val, CNFD):.3f} %")
-    assert val == pytest.approx(CNFD, rel=1e-2)
\ No newline at end of file
+    assert val == pytest.approx(CNFD, rel=1e-2)
+
+
+def test_american_put_bounds():
+    option = opt.AmericanOption(100, 100, 0.05, 0.0, 0.2, 1, phi=-1)
+    pricer = fdm.FDMPricer(option)
+    pricer.space_steps = 2000
+    pricer.time_steps = 200
+    price = pricer.price()
+    assert pricer.ex[0] == pytest.approx(81.6, abs=0.5)
+    assert pricer.ex[-2] == pytest.approx(96.9, abs=0.5)
+
+    pricer.track_bounds = False
+    assert pricer.price() == pytest.approx(price, rel=1e-14)
+
+@pytest.mark.parametrize("phi, stop, ex", [(+1, 78.78, 128.88), (-1, 126.81, 82.32)])
+def test_american_installment_bounds(phi, stop, ex):
+    option = opt.AmericanContinuousInstallmentOption(100, 100, 0.05, 0.04, 0.2, 1, 3, phi=phi)
+    pricer = fdm.FDMPricer(option)
+    pricer.price()
+    # the stop region lies out of the money, the exercise projection must not hide it
+    assert pricer.stop[0] == pytest.approx(stop, abs=0.05)
+    assert pricer.ex[0] == pytest.approx(ex, abs=0.05)
+    assert np.all(phi * (pricer.ex[:-1] - pricer.stop[:-1]) > 0)
+
+@pytest.mark.parametrize("phi", [-1, +1])
+def test_euro_greeks(phi):
+    S, K, r, d, vola, T = 100, 100, 0.05, 0.02, 0.2, 1
+    option = opt.Option(S, K, r, d, vola, T, phi=phi)
+    pricer = fdm.FDMPricer(option)
+    pricer.space_steps = 2000
+    pricer.time_steps = 400
+    greeks = pricer.greeks()
+
+    delta = phi * np.exp(-d * T) * norm.cdf(phi * bs.d1(S, K, r, d, vola, T))
+    assert greeks["price"] == pytest.approx(bs.option_value(S, K, r, d, vola, T, phi), rel=1e-2)
+    assert greeks["delta"] == pytest.approx(delta, abs=1e-3)
+    assert greeks["gamma"] == pytest.approx(0.018950578564158604, rel=1e-2)
+    assert greeks["vega"] == pytest.approx(37.901157387914, rel=1e-2)
+
+@pytest.mark.parametrize("grid", ['stretched', 'log'])
+@pytest.mark.parametrize("option", [
+    opt.AmericanOption(95, 100, 0.05, 0.0, 0.2, 1, phi=-1),
+    opt.ContinuousInstallmentOption(104, 100, 0.05, 0.04, 0.2, 1, 8, phi=+1),
+    ])
+def test_grids(grid, option):
+    uniform = fdm.FDMPricer(option)
+    uniform.time_steps = 200
+    pricer = fdm.FDMPricer(option)
+    pricer.time_steps = 200
+    pricer.space_steps = 1000
+    pricer.grid = grid
+    assert pricer.price() == pytest.approx(uniform.price(), abs=2e-4)
+    assert pricer.stop[0] == pytest.approx(uniform.stop[0], rel=2e-2)
+
+def test_unknown_grid():
+    pricer = fdm.FDMPricer(opt.Option(100, 100, 0.05, 0.0, 0.2, 1, phi=+1))
+    pricer.grid = 'chebyshev'
+    with pytest.raises(TypeError):
+        pricer.price()
+
+@pytest.mark.parametrize("phi", [-1, +1])
+def test_euro_crank_nicolson(phi):
+    S, K, r, d, vola, T = 100, 100, 0.05, 0.02, 0.2, 1
+    option = opt.Option(S, K, r, d, vola, T, phi=phi)
+    pricer = fdm.FDMPricer(option)
+    pricer.scheme = 'crank-nicolson'
+    pricer.grid = 'stretched'
+    pricer.space_steps = 1000
+    pricer.time_steps = 100
+    assert pricer.price() == pytest.approx(bs.option_value(S, K, r, d, vola, T, phi), abs=5e-4)
+
+@pytest.mark.parametrize("S, r, d, expected", td.std_american_put[:6])
+def test_american_put_crank_nicolson(S, r, d, expected):
+    option = opt.AmericanOption(S, 100, r, d, 0.2, 1, phi=-1)
+    pricer = fdm.FDMPricer(option)
+    pricer.scheme = 'crank-nicolson'
+    pricer.grid = 'stretched'
+    pricer.space_steps = 1000
+    pricer.time_steps = 400
+    assert pricer.price() == pytest.approx(expected, rel=2e-3)
+
+def test_unknown_scheme():
+    pricer = fdm.FDMPricer(opt.Option(100, 100, 0.05, 0.0, 0.2, 1, phi=+1))
+    pricer.scheme = 'runge-kutta'
+    with pytest.raises(TypeError):
+        pricer.price()
+
+def test_factored_solve():
+    rng = np.random.default_rng(1)
+    n = 50
+    main = 4 + rng.random(n)
+    lower = np.append(rng.random(n - 1), 0)
+    upper = np.insert(rng.random(n - 1), 0, 0)
+    b = rng.random(n)
+    # reference solve of the banded system
+    expected = solve_banded((1, 1), np.array([upper, main, lower]), b)
+    factors = fdm._factor_tridiagonal(upper, main, lower)
+    x = b.copy()
+    assert fdm._solve_factored(factors, x) is x
+    assert x == pytest.approx(expected, rel=1e-12)
+
+@pytest.mark.parametrize("S, r, d, expected", td.std_american_put[:6])
+def test_american_put_penalty(S, r, d, expected):
+    option = opt.AmericanOption(S, 100, r, d, 0.2, 1, phi=-1)
+    pricer = fdm.FDMPricer(option)
+    pricer.scheme = 'crank-nicolson'
+    pricer.lcp = 'penalty'
+    pricer.grid = 'stretched'
+    pricer.space_steps = 1000
+    pricer.time_steps = 100
+    assert pricer.price() == pytest.approx(expected, rel=2e-3)
+
+def test_american_installment_penalty():
+    option = opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1, 3, phi=+1)
+    pricer = fdm.FDMPricer(option)
+    pricer.scheme = 'crank-nicolson'
+    pricer.lcp = 'penalty'
+    pricer.grid = 'stretched'
+    pricer.space_steps = 1000
+    pricer.time_steps = 200
+    assert pricer.price() == pytest.approx(3.8367, abs=2e-3)
+    assert pricer.stop[0] == pytest.approx(78.5, abs=1)
+    assert pricer.ex[0] == pytest.approx(129.2, abs=1)
+
+def test_unknown_lcp():
+    pricer = fdm.FDMPricer(opt.AmericanOption(100, 100, 0.05, 0.0, 0.2, 1, phi=-1))
+    pricer.lcp = 'psor'
+    with pytest.raises(TypeError):
+        pricer.price()
+
+@pytest.mark.parametrize("grid", ['uniform', 'stretched', 'log'])
+def test_spot_ladder(grid):
+    K, r, d, vola, T = 100, 0.05, 0.02, 0.2, 1
+    spots = np.linspace(60, 160, 51)
+    option = opt.Option(100, K, r, d, vola, T, phi=-1)
+    pricer = fdm.FDMPricer(option)
+    pricer.scheme = 'crank-nicolson'
+    pricer.grid = grid
+    pricer.space_steps = 2000
+    pricer.time_steps = 200
+    values = pricer.values(spots)
+    assert values == pytest.approx(bs.option_value(spots, K, r, d, vola, T, -1), abs=2e-3)
+    assert values[20] == pytest.approx(pricer.price(), abs=2e-3)
+
+@pytest.mark.parametrize("kwargs", [
+    {'grid': 'uniform'},
+    {'grid': 'log', 'scheme': 'crank-nicolson', 'lcp': 'penalty'},
+    ])
+def test_batch_pricer(kwargs):
+    options = [
+        opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1, phi=-1),
+        opt.AmericanOption(105, 100, 0.1, 0.04, 0.2, 1, phi=+1),
+        opt.Option(100, 100, 0.05, 0.0, 0.3, 0.5, phi=+1),
+        opt.ContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1, 3, phi=+1),
+        opt.AmericanContinuousInstallmentOption(104, 100, 0.05, 0.04, 0.2, 1, 8, phi=+1),
+        opt.AmericanContinuousInstallmentOption(52, 50, 0.05, 0.04, 0.25, 1, 2, phi=-1),
+    ]
+    batch = fdm.FDMBatchPricer.from_options(options, space_steps=1000, time_steps=200, **kwargs)
+    prices = batch.price()
+    for i, option in enumerate(options):
+        pricer = fdm.FDMPricer(option)
+        pricer.space_steps = 1000
+        pricer.time_steps = 200
+        for name, value in kwargs.items():
+            setattr(pricer, name, value)
+        assert prices[i] == pytest.approx(pricer.price(), abs=5e-4)
+        assert batch.stop_bound[i, 0] == pytest.approx(pricer.stop[0], rel=5e-3)
+        assert batch.ex_bound[i, 0] == pytest.approx(pricer.ex[0], rel=5e-3)
+
+def test_batch_pricer_single_option():
+    option = opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1, 3, phi=+1)
+    pricer = fdm.FDMPricer(option)
+    pricer.space_steps = 1000
+    pricer.time_steps = 200
+    batch = fdm.FDMBatchPricer.from_options([option], space_steps=1000, time_steps=200)
+    assert batch.price()[0] == pytest.approx(pricer.price(), rel=1e-10)
+    assert batch.stop_bound[0] == pytest.approx(pricer.stop, rel=1e-10)
+    assert batch.ex_bound[0] == pytest.approx(pricer.ex, rel=1e-10)
+
+def test_adaptive_time_stepping():
+    option = opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 3, 3, phi=+1)
+    def pricer(time_stepping, time_steps):
+        pricer = fdm.FDMPricer(option)
+        pricer.scheme = 'crank-nicolson'
+        pricer.lcp = 'penalty'
+        pricer.grid = 'stretched'
+        pricer.space_steps = 1000
+        pricer.time_steps = time_steps
+        pricer.time_stepping = time_stepping
+        pricer.dnorm = 0.05
+        return pricer
+    uniform = pricer('uniform', 2000)
+    adaptive = pricer('adaptive', 100)
+    assert adaptive.price() == pytest.approx(uniform.price(), abs=5e-4)
+    assert adaptive.stop[0] == pytest.approx(uniform.stop[0], rel=1e-2)
+    # the steps are refined at maturity and coarsened before
+    times = adaptive.times
+    assert len(times) < 200
+    assert times[0] == 0 and times[-1] == pytest.approx(3)
+    assert np.diff(times)[0] > 10 * np.diff(times)[-1]
+    assert len(adaptive.stop) == len(times) and len(adaptive.ex) == len(times)
+
+def _schedule_pricer(option):
+    pricer = fdm.FDMPricer(option)
+    pricer.scheme = 'crank-nicolson'
+    pricer.grid = 'stretched'
+    pricer.space_steps = 1000
+    pricer.time_steps = 200
+    return pricer
+
+@pytest.mark.parametrize("S, expected", [(95, 2.848602143652627), (100, 4.772140468389111), (105, 7.30436820013986)])
+def test_discrete_installment_call(S, expected):
+    option = opt.DiscreteInstallmentOption(S, 0.02, 0.01, 0.2, [0.5, 1], [5, 100], +1)
+    pricer = _schedule_pricer(option)
+    assert pricer.price() == pytest.approx(expected, abs=1e-3)
+    date = np.argmin(np.abs(pricer.times - 0.5))
+    assert pricer.times[date] == pytest.approx(0.5, abs=1e-12)
+    assert pricer.stop[date] == pytest.approx(98.3605222246888, rel=2e-3)
+    assert pricer.stop[-1] == 100
+
+def test_bermuda_put():
+    t = [0.25, 0.5, 0.75, 1]
+    option = opt.BermudaOption(95, 0.05, 0.0, 0.2, t, 100, -1)
+    pricer = _schedule_pricer(option)
+    assert pricer.price() == pytest.approx(8.276276708904168, abs=1e-3)
+    exercise = pricer.ex[np.isin(np.round(pricer.times, 12), t[:-1])]
+    assert len(exercise) == 3
+    assert np.all(np.diff(exercise) > 0)
+
+@pytest.mark.parametrize("option, dates", [
+    (opt.BermudaOption(95, 0.05, 0.0, 0.2, [0.25, 0.5, 0.75, 1], 100, -1), [0.25, 0.5, 0.75]),
+    (opt.DiscreteInstallmentOption(100, 0.02, 0.01, 0.2, [0.5, 1], [5, 100], +1), [0.5])])
+def test_adaptive_schedule(option, dates):
+    uniform = _schedule_pricer(option)
+    adaptive = _schedule_pricer(option)
+    adaptive.time_stepping = 'adaptive'
+    adaptive.dnorm = 0.05
+    assert adaptive.price() == pytest.approx(uniform.price(), abs=2e-3)
+    # the steps end on the dates and restart small after each of them
+    times = np.round(adaptive.times, 12)
+    assert np.all(np.isin(dates, times))
+    first_step = option.T / adaptive.time_steps / 16
+    for date in dates:
+        index = np.argmin(np.abs(times - date))
+        assert times[index] - times[index - 1] == pytest.approx(first_step)
+
+def test_long_installment_schedule():
+    option = opt.ContinuousInstallmentOption(104, 100, 0.05, 0.04, 0.2, 1, 8, phi=+1)
+    continuous = _schedule_pricer(option).price()
+    errors = [abs(_schedule_pricer(opt.continuous_to_discrete(option, n)).price() - continuous) for n in [10, 50, 250]]
+    assert errors[2] < errors[1] < errors[0]
+    assert errors[2] < 3e-2
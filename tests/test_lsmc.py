@@ -1,7 +1,10 @@
+import pickle
+import warnings
 import pytest
+import numpy as np
 
 from pystallment.algorithms import lsmc as lsmc
-from pystallment import option as opt
+from pystallment import black_scholes as bs, option as opt
 from pystallment.algorithms.binomial import BinomialPricer
 
 def test_american_put():
@@ -62,3 +65,231 @@ def test_american_installment_call():
     mcprice = mcp.price()
     print(f"MC Price = {mcprice:.3f}")
     assert mcprice == pytest.approx(3.8362, abs=1e-1)
+
+def test_american_put_bridge():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, num_paths=int(1e4), generation='bridge')
+    mcp.seed = 42
+    mcprice = mcp.price()
+    assert mcprice == pytest.approx(9.754, 1e-1)
+    # only one time slice is kept in memory
+    assert not hasattr(mcp, "paths")
+
+@pytest.mark.parametrize("generation", ['forward', 'bridge'])
+def test_odd_num_paths(generation):
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, num_paths=5001, generation=generation)
+    mcp.seed = 42
+    # the paths are rounded down to whole antithetic pairs
+    assert mcp.num_paths == 5000
+    assert mcp.price() == pytest.approx(9.754, 1e-1)
+
+@pytest.mark.parametrize("basis", ['power', 'hermite', 'laguerre'])
+def test_regression(basis):
+    rng = np.random.default_rng(1)
+    S = rng.uniform(50, 150, 1000)
+    y = 2 + 0.3 * S - 0.01 * S**2 + 1e-5 * S**3
+    regression = lsmc.Regression(basis, 3, K=100)
+    coefficients, fitted = regression.fit(S, y)
+    assert fitted == pytest.approx(y, rel=1e-8)
+    restored = pickle.loads(pickle.dumps(regression))
+    assert restored.predict(coefficients, S[:10]) == pytest.approx(y[:10], rel=1e-8)
+
+def test_american_put_basis():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, num_paths=int(1e4), basis='laguerre')
+    mcp.seed = 42
+    assert mcp.price() == pytest.approx(9.754, 1e-1)
+
+def test_unknown_basis():
+    with pytest.raises(TypeError):
+        lsmc.Regression('chebyshev')
+
+def test_std_error():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, num_paths=int(1e4), basis='laguerre')
+    mcp.seed = 42
+    mcprice = mcp.price()
+    assert 0 < mcp.std_error < 0.2
+    assert mcprice == pytest.approx(9.754, abs=4 * mcp.std_error)
+
+def test_price_parallel():
+    option = opt.ContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1.0, 3, phi=+1)
+    mcp = lsmc.LSMCPricer(option, num_paths=int(2e4), basis='laguerre', generation='bridge')
+    mcp.seed = 7
+    price, std_error = mcp.price_parallel(processes=2, num_chunks=4)
+    assert price == pytest.approx(3.652, abs=4 * std_error)
+    assert std_error == mcp.std_error
+    # the result depends on the seed and the chunks only
+    assert mcp.price_parallel(processes=1, num_chunks=4) == (price, std_error)
+
+def test_sobol_sampler():
+    option = opt.Option(100, 100, 0.05, 0.04, 0.2, 1.0, +1)
+    expected = bs.option_value(100, 100, 0.05, 0.04, 0.2, 1.0, +1)
+    pseudo = lsmc.LSMCPricer(option, num_paths=2**14, basis='laguerre')
+    pseudo.seed = 3
+    pseudo.price()
+    sobol = lsmc.LSMCPricer(option, num_paths=2**14, basis='laguerre', sampler='sobol')
+    sobol.seed = 3
+    assert sobol.price() == pytest.approx(expected, abs=4 * sobol.std_error)
+    assert 0 < sobol.std_error < 0.1 * pseudo.std_error
+
+def test_sobol_replicates_power_of_two():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    sobol = lsmc.LSMCPricer(option, num_paths=10000, basis='laguerre', sampler='sobol', replicates=4)
+    sobol.seed = 5
+    # 2500 points per replicate would lose the balance properties of the Sobol sequence
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        sobol.price()
+
+def test_sobol_price_parallel():
+    option = opt.Option(100, 100, 0.05, 0.04, 0.2, 1.0, +1)
+    expected = bs.option_value(100, 100, 0.05, 0.04, 0.2, 1.0, +1)
+    sobol = lsmc.LSMCPricer(option, num_paths=2**14, basis='laguerre', sampler='sobol')
+    sobol.seed = 1
+    # the chunks are seeded with spawned sequences, which seed the replicates in turn
+    price, std_error = sobol.price_parallel(processes=1, num_chunks=2)
+    assert price == pytest.approx(expected, abs=4 * std_error)
+    assert sobol.price_parallel(processes=1, num_chunks=2) == (price, std_error)
+
+def test_sobol_price_to_tolerance():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    sobol = lsmc.LSMCPricer(option, basis='laguerre', sampler='sobol')
+    sobol.seed = 1
+    # every replicate of a batch fits its own regressions, which needs a few thousand paths
+    price = sobol.price_to_tolerance(atol=2e-2, batch_paths=2**15)
+    assert sobol.std_error <= 2e-2
+    assert sobol.converged_paths % 2**15 == 0
+    assert price == pytest.approx(9.754, abs=4 * sobol.std_error + 1e-2)
+
+def test_unknown_sampler():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    with pytest.raises(TypeError):
+        lsmc.LSMCPricer(option, num_paths=1000, sampler='halton').price()
+    with pytest.raises(TypeError):
+        lsmc.LSMCPricer(option, num_paths=1000, sampler='sobol', generation='bridge').price()
+
+@pytest.mark.parametrize("sampler", ['pseudo', 'sobol'])
+def test_control_variate(sampler):
+    option = opt.ContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1.0, 3, phi=+1)
+    plain = lsmc.LSMCPricer(option, num_paths=2**14, basis='laguerre', sampler=sampler)
+    plain.seed = 5
+    plain.price()
+    assert plain.variance_reduction is None
+    mcp = lsmc.LSMCPricer(option, num_paths=2**14, basis='laguerre', sampler=sampler, control_variate=True)
+    mcp.seed = 5
+    assert mcp.price() == pytest.approx(3.652, abs=4 * mcp.std_error + 5e-3)
+    if sampler == 'pseudo':
+        assert mcp.variance_reduction > 5
+        assert mcp.std_error < 0.5 * plain.std_error
+
+@pytest.mark.parametrize("basis", [None, 'laguerre'])
+def test_policy(basis):
+    option = opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1.0, 3, phi=+1)
+    fitted = lsmc.LSMCPricer(option, num_paths=2**14, basis=basis)
+    fitted.seed = 1
+    in_sample = fitted.price()
+    policy = pickle.loads(pickle.dumps(fitted.policy))
+    assert len(policy.exercise) > 0 and len(policy.stop) > 0
+
+    fresh = lsmc.LSMCPricer(option, num_paths=2**14, basis=basis)
+    fresh.seed = 2
+    assert fresh.price(policy) == pytest.approx(in_sample, abs=5 * fresh.std_error)
+    assert fresh.policy is policy
+
+    # nearby spot and shorter time to maturity, the policy is used without refitting
+    shifted = opt.AmericanContinuousInstallmentOption(98, 100, 0.05, 0.04, 0.2, 0.99, 3, phi=+1)
+    reused = lsmc.LSMCPricer(shifted, num_paths=2**14, basis=basis)
+    reused.seed = 3
+    refitted = lsmc.LSMCPricer(shifted, num_paths=2**14, basis=basis)
+    refitted.seed = 3
+    assert reused.price(policy) == pytest.approx(refitted.price(), abs=5 * refitted.std_error)
+
+def test_policy_parallel():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, num_paths=2**13, basis='laguerre')
+    mcp.seed = 1
+    mcp.price()
+    price, std_error = mcp.price_parallel(processes=2, num_chunks=2, policy=mcp.policy)
+    assert price == pytest.approx(9.754, abs=4 * std_error + 2e-2)
+
+def test_price_to_tolerance():
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, basis='laguerre')
+    mcp.seed = 11
+    price = mcp.price_to_tolerance(atol=2e-2, batch_paths=2**13)
+    assert mcp.std_error <= 2e-2
+    assert mcp.converged_paths % 2**13 == 0
+    assert price == pytest.approx(9.754, abs=4 * mcp.std_error + 1e-2)
+
+    # the limits stop the batches before the tolerance is met
+    assert mcp.price_to_tolerance(atol=1e-6, batch_paths=2**12, max_paths=2**14) > 0
+    assert mcp.converged_paths == 2**14
+    mcp.price_to_tolerance(atol=1e-6, batch_paths=2**12, time_budget=0)
+    assert mcp.converged_paths == 2**12
+
+    # odd batches are rounded down to whole antithetic pairs
+    assert mcp.price_to_tolerance(atol=1e-6, batch_paths=5001, max_paths=10000) > 0
+    assert mcp.converged_paths == 10000
+
+def test_path_cache():
+    cache = lsmc.PathCache()
+    for K, q in [(95, 1), (100, 3), (105, 3)]:
+        option = opt.AmericanContinuousInstallmentOption(100, K, 0.05, 0.04, 0.2, 1.0, q, phi=+1)
+        cached = lsmc.LSMCPricer(option, num_paths=2**12, basis='laguerre')
+        cached.seed = 7
+        cached.path_cache = cache
+        uncached = lsmc.LSMCPricer(option, num_paths=2**12, basis='laguerre')
+        uncached.seed = 7
+        assert cached.price() == uncached.price()
+        assert not cached.paths.flags.writeable
+    # one set of paths serves the whole book
+    assert len(cache) == 1
+
+    # the least recently used paths are evicted
+    cache.max_bytes = 1.5 * cache.nbytes
+    mcp = lsmc.LSMCPricer(opt.AmericanOption(100, 100, 0.05, 0.04, 0.25, 1.0, -1), num_paths=2**12)
+    mcp.seed = 7
+    mcp.path_cache = cache
+    mcp.price()
+    key = mcp._cache_key(mcp.seed)
+    assert len(cache) == 1 and cache.get(key) is not None
+    assert len(pickle.loads(pickle.dumps(cache))) == 0
+
+    # unseeded paths are not cached, neither are the paths of an unseeded Richardson extrapolation,
+    # so they do not evict the seeded paths
+    mcp.seed = None
+    mcp.price()
+    mcp.richardson = True
+    mcp.price()
+    assert len(cache) == 1 and cache.get(key) is not None
+
+@pytest.mark.parametrize("generation", ['forward', 'bridge'])
+def test_decision_times(generation):
+    # without decisions before maturity the installments are paid until maturity
+    option = opt.ContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1.0, 3, phi=+1)
+    mcp = lsmc.LSMCPricer(option, num_paths=2**12, generation=generation, control_variate=True)
+    mcp.decision_times = [1.0]
+    mcp.seed = 2
+    annuity = 3 / 0.05 * (1 - np.exp(-0.05))
+    expected = bs.option_value(96, 100, 0.05, 0.04, 0.2, 1.0, +1) - annuity
+    assert mcp.price() == pytest.approx(expected, abs=1e-10)
+    assert mcp.times == pytest.approx([0, 1.0])
+
+    option = opt.AmericanOption(95, 100, 0.05, 0.04, 0.2, 1.0, -1)
+    mcp = lsmc.LSMCPricer(option, num_paths=2**14, generation=generation, basis='laguerre')
+    mcp.decision_times = np.concatenate((np.linspace(0.02, 0.5, 25), np.linspace(0.55, 1.5, 20)))
+    mcp.seed = 2
+    assert mcp.price() == pytest.approx(9.754, abs=4 * mcp.std_error + 2e-2)
+    assert len(mcp.times) == 36
+    assert len(mcp.policy.exercise) == 35
+
+def test_richardson():
+    option = opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1.0, 3, phi=+1)
+    mcp = lsmc.LSMCPricer(option, num_paths=2**14, basis='laguerre', richardson=True)
+    mcp.time_steps = 16
+    mcp.seed = 3
+    assert mcp.price() == pytest.approx(3.837, abs=4 * mcp.std_error)
+    # the policy of the fine grid is kept
+    assert len(mcp.policy.stop) == 16
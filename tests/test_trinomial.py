@@ -0,0 +1,54 @@
+import pytest
+import numpy as np
+
+from pystallment.algorithms import trinomial as tp
+from pystallment import black_scholes as bs, option as opt
+import test_data as td
+
+@pytest.mark.parametrize("S, r, d, expected", td.std_american_put)
+def test_american_put(S, r, d, expected):
+    K = 100
+    vola = 0.2
+    T = 1
+
+    option = opt.AmericanOption(S, K, r, d, vola, T, phi=-1)
+    pricer = tp.TrinomialPricer(option, num_steps=800, refine_levels=2)
+    price = pricer.price()
+    assert price == pytest.approx(expected, rel=1e-3)
+
+@pytest.mark.parametrize("phi", [-1, +1])
+@pytest.mark.parametrize("S", [95, 100, 105])
+def test_euro_option(S, phi):
+    K = 100
+    r = 0.05
+    d = 0.04
+    vola = 0.2
+    T = 1
+
+    option = opt.Option(S, K, r, d, vola, T, phi=phi)
+    pricer = tp.TrinomialPricer(option, num_steps=200, refine_levels=3)
+    expected = bs.option_value(S, K, r, d, vola, T, phi)
+    assert pricer.price() == pytest.approx(expected, abs=5e-4)
+
+@pytest.mark.parametrize("vola, S, T, q, CNFD", td.ciurlia_inst_call_short)
+def test_installment_call_ciurlia(vola, S, T, q, CNFD):
+    K = 100
+    r = 0.05
+    d = 0.04
+
+    option = opt.ContinuousInstallmentOption(S=S, K=K, r=r, d=d, vola=vola, T=T, q=q, phi=+1)
+    pricer = tp.TrinomialPricer(option, num_steps=200, refine_levels=2)
+    val = pricer.price()
+    print(f"val = {val:.3f}, diff = {(val-CNFD)*100/max(val, CNFD):.3f} %")
+    assert val == pytest.approx(CNFD, abs=1e-2)
+
+def test_american_installment_call_bounds():
+    option = opt.AmericanContinuousInstallmentOption(96, 100, 0.05, 0.04, 0.2, 1, 3, phi=+1)
+    pricer = tp.TrinomialPricer(option, num_steps=200, refine_levels=2)
+    assert pricer.price() == pytest.approx(3.8367, abs=5e-3)
+    assert len(pricer.times) == len(pricer.stop_bound) == len(pricer.ex_bound)
+    assert pricer.times[-1] == pytest.approx(1.0)
+    # the stop boundary lies below and the exercise boundary above the strike
+    assert np.all(pricer.stop_bound <= 100)
+    assert np.all(pricer.ex_bound >= 100)
+    assert pricer.stop_bound[0] == pytest.approx(78.5, abs=1.0)